@@ -21,6 +21,8 @@ ex-playback.py
     -body   :   1 to display wireframes, 0 to skip. Default is 1.
     
     -c <output.avi>     :   Signals the program to convert the playback data to an .avi file
+    -p <processes>      :   Converts segments of the recording in parallel using this many processes
+                            and joins them with ffmpeg (converts in one process without ffmpeg)
     -t <start:end>      :   Specifies the timeframe (in seconds) to playback
 """
 
@@ -73,6 +75,12 @@ if __name__ == "__main__":
 
         kwargs['outputFile'] =  args[args.index("-c") + 1]
 
+        if "-p" in args:
+
+            application = PyKinectTk.Playback.ParallelConvert
+
+            kwargs['processes'] = int(args[args.index("-p") + 1])
+
     if "-t" in args:
 
         time = args[args.index("-t") + 1].split(':')
@@ -0,0 +1,282 @@
+"""
+    Benchmark.py
+
+    Measures how quickly KinectService can capture data by driving it
+    with a SyntheticSource. Each run is recorded into the working
+    environment and deleted afterwards.
+
+    Usage:
+
+        python -m PyKinectTk.Capture.Benchmark [options]
+
+    Options:
+
+    --bodies 1 2 3      :   Numbers of bodies to test. Default is 1 to 6.
+    --frames <n>        :   Number of frames captured in each run. Default is 300.
+    --streams <s> ...   :   Stream combinations to test: body, video, audio, all.
+                            Default is all four.
+    --background        :   Also run each test with the background writer processes.
+    --packed            :   Store joints in tbl_SkeletonData instead of tbl_JointData.
+    --audio-seconds <n> :   Instead, time writing n seconds of audio subframes with
+                            StreamingAudioWriter and AudioWriter, e.g. 3600 for a 1 hour capture.
+    --output <file>     :   Write the results to a JSON file.
+"""
+
+# Utility modules
+from ..utils import *
+from ..utils.SQL import *
+
+from DataCapture import KinectService
+from Writers import AudioWriter, StreamingAudioWriter, AUDIO_RATE
+from Sources import SyntheticSource
+
+from os.path import getsize, isfile
+from os import remove
+from resource import getrusage, RUSAGE_SELF
+from timeit import default_timer as clock
+
+import numpy as np
+import platform
+import json
+import time
+import sys
+
+STREAMS = {"body":  (False, False),
+           "video": (True,  False),
+           "audio": (False, True),
+           "all":   (True,  True)}
+
+class StageTimer:
+    """ Records how long each call to a wrapped method takes """
+
+    def __init__(self):
+        self.samples = {}
+
+    def wrap(self, obj, method, stage):
+        """ Replaces obj.method with a version that records its duration under stage """
+        func = getattr(obj, method)
+        samples = self.samples.setdefault(stage, [])
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                samples.append(clock() - start)
+        setattr(obj, method, timed)
+        return
+
+    def percentiles(self):
+        """ Returns a dict of stage -> latency statistics in milliseconds """
+        stats = {}
+        for stage, samples in self.samples.items():
+            if not samples:
+                continue
+            ms = np.array(samples) * 1000
+            stats[stage] = {"calls": len(ms),
+                            "total": float(ms.sum()),
+                            "p50": float(np.percentile(ms, 50)),
+                            "p90": float(np.percentile(ms, 90)),
+                            "p99": float(np.percentile(ms, 99)),
+                            "max": float(ms.max())}
+        return stats
+
+def filesize(path):
+    return getsize(path) if isfile(path) else 0
+
+def database_bytes():
+    """ Returns the number of bytes of the database in use. Pages freed by deleting
+        earlier runs are left out as SQLite re-uses them instead of growing the file """
+    with Database(DATABASE) as db:
+        pages, free, size = [db._db.execute("PRAGMA %s" % pragma).fetchone()[0] for pragma in ("page_count", "freelist_count", "page_size")]
+    return (pages - free) * size
+
+def count_rows(p_id):
+    """ Returns the number of joint and hand rows stored for a performance """
+    with Database(DATABASE) as db:
+        return sum(len(db.query(table, p_id, columns=("frame",))) for table in (JOINT_DATA_TABLE, SKELETON_DATA_TABLE, HAND_DATA_TABLE))
+
+def run(bodies, frames=300, video=False, audio=False, background=False, packed=False, resolution=(1920, 1080)):
+    """ Captures one synthetic recording and returns a dict of results """
+
+    source  = SyntheticSource(bodies, frames=frames, resolution=resolution, video=video, audio=audio)
+
+    service = KinectService(timeout=1, source=source, background=background, packed=packed)
+
+    # Time each stage of the capture loop
+
+    timer = StageTimer()
+
+    timer.wrap(source, "get_new_body_frames", "acquire_body")
+    timer.wrap(source, "get_new_color_frames", "acquire_video")
+    timer.wrap(source, "get_new_audio_frames", "acquire_audio")
+    timer.wrap(source, "body_joints_to_color_space", "map_joints")
+    timer.wrap(service._buffer, "add", "database")
+    timer.wrap(service._buffer, "extend", "database")
+    timer.wrap(service._video, "write", "video")
+    timer.wrap(service._audio, "add", "audio")
+
+    db_size = database_bytes()
+
+    start = clock()
+
+    service.listen(getVideo=video, getAudio=audio)
+
+    elapsed = clock() - start
+
+    p_id = service._p_id
+
+    service.close()
+
+    # Collect results
+
+    rows = count_rows(p_id)
+
+    written = database_bytes() - db_size + filesize(service._video_path) + filesize(service._audio_path)
+
+    result = {"bodies": bodies,
+              "frames": frames,
+              "video": video,
+              "audio": audio,
+              "background": background,
+              "packed": packed,
+              "elapsed": elapsed,
+              "frames_per_sec": len(service._body_stream) / elapsed,
+              "rows": rows,
+              "rows_per_sec": rows / elapsed,
+              "bytes_written": written,
+              "stages": timer.percentiles(),
+              "writers": service.writer_stats(),
+              "color_pool": source._color_pool.stats(),
+              "rings": source.ring_stats()}
+
+    # Remove the recording
+
+    DeletePerformance(p_id)
+
+    for path in (service._video_path, service._audio_path):
+
+        if isfile(path):
+
+            remove(path)
+
+    return result
+
+def audio_run(seconds, streaming=False, subframe=256):
+    """ Adds seconds of audio to an audio writer in Kinect sized subframes, writes
+        it to file and returns a dict of the time taken and memory used """
+
+    path = AUDIO_DIR + "benchmark_audio.wav"
+
+    if streaming:
+
+        writer = StreamingAudioWriter(path, timeout=None)
+
+        writer.start()
+
+    else:
+
+        writer = AudioWriter(path)
+
+    samples = (0.5 * np.sin(2 * np.pi * 440 * np.arange(subframe) / float(AUDIO_RATE))).astype(np.float32)
+
+    count = int(seconds * AUDIO_RATE) // subframe
+
+    start = clock()
+
+    for i in range(count):
+
+        writer.add(samples)
+
+    added = clock() - start
+
+    held = 0 if streaming else writer.nbytes()
+
+    start = clock()
+
+    writer.write()
+
+    written = clock() - start
+
+    result = {"writer": writer.__class__.__name__,
+              "seconds": seconds,
+              "subframes": count,
+              "add_elapsed": added,
+              "add_per_subframe_us": added / max(count, 1) * 1e6,
+              "write_elapsed": written,
+              "bytes_held": held,
+              "bytes_written": filesize(path),
+              "max_rss_bytes": getrusage(RUSAGE_SELF).ru_maxrss * 1024}
+
+    writer.release()
+
+    remove(path)
+
+    return result
+
+def main(args):
+
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description="PyKinectTk capture benchmark")
+    parser.add_argument("--bodies", type=int, nargs="+", default=range(1, 7))
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--streams", nargs="+", choices=sorted(STREAMS), default=["body", "video", "audio", "all"])
+    parser.add_argument("--background", action="store_true")
+    parser.add_argument("--packed", action="store_true")
+    parser.add_argument("--audio-seconds", type=float, default=None)
+    parser.add_argument("--output", default=None)
+
+    options = parser.parse_args(args)
+
+    results = []
+
+    if options.audio_seconds is not None:
+
+        # Max RSS only ever grows so the streaming writer goes first
+
+        for streaming in (True, False):
+
+            result = audio_run(options.audio_seconds, streaming)
+
+            results.append(result)
+
+            print "%-20s %.0fs of audio: %.2fs adding (%.1fus/subframe), %.2fs writing, %d bytes held, %d bytes max RSS" % (result["writer"], options.audio_seconds, result["add_elapsed"], result["add_per_subframe_us"],
+                                                                                                                   result["write_elapsed"], result["bytes_held"], result["max_rss_bytes"])
+
+        options.bodies = []
+
+    for bodies in options.bodies:
+
+        for streams in options.streams:
+
+            for background in ((False, True) if options.background else (False,)):
+
+                video, audio = STREAMS[streams]
+
+                result = run(bodies, options.frames, video, audio, background, options.packed)
+
+                result["streams"] = streams
+
+                results.append(result)
+
+                print "\n%d bodies, %-5s %s: %.1f frames/s, %.0f rows/s, %d bytes" % (bodies, streams, "(background)" if background else "",
+                                                                                    result["frames_per_sec"], result["rows_per_sec"], result["bytes_written"])
+
+                for stage, stats in sorted(result["stages"].items()):
+
+                    print "    %-14s p50 %8.3fms  p90 %8.3fms  p99 %8.3fms" % (stage, stats["p50"], stats["p90"], stats["p99"])
+
+    if options.output is not None:
+
+        with open(options.output, "w") as f:
+
+            json.dump({"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "results": results}, f, indent=2)
+
+    return results
+
+if __name__ == "__main__":
+
+    main(sys.argv[1:])
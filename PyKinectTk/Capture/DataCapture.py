@@ -8,22 +8,27 @@
 # Utility modules
 from ..utils import *
 from ..utils.SQL import *
-from ..utils.PyKinect2 import *  
+
+# The Kinect runtime needs the Windows Kinect service, the other frame sources do not
+try:
+    from ..utils.PyKinect2 import *
+except ImportError:
+    PyKinectRuntime = None
 
 #: Import a user friendly wrapper for writing video / audio
-from Writers import VideoWriter, AudioWriter
+from Writers import ThreadedVideoWriter, StreamingAudioWriter, AUDIO_RATE
+
+# Use processes to write data
+from Writers import DatabaseWriterProcess, VideoWriterProcess, AudioWriterProcess
 
 # Use time from stdlib to check timeout
 from time import time as now
 
-# Use processes to write data
-from multiprocessing import Process
-
 # This is object that listens from Kinect data, live or playback, and records joint data
 
 class KinectService():
     
-    def __init__(self, timeout=1):
+    def __init__(self, timeout=1, batch_size=2000, batch_wait=1.0, background=False, source=None, packed=False):
 
         # Loop until the program stop receiving kinect stream data
         self._done = False
@@ -39,29 +44,52 @@ class KinectService():
         self._wait = None
         self._timeout = timeout
 
-        # Kinect runtime object
-        self._kinect = PyKinectRuntime(PyKinectV2.FrameSourceTypes_Color | PyKinectV2.FrameSourceTypes_Body | PyKinectV2.FrameSourceTypes_Body )
+        # Kinect runtime object, or any other frame source (see Sources.py)
+        if source is None:
+
+            if PyKinectRuntime is None:
+
+                raise ImportError("The Kinect runtime could not be loaded, use a frame source from Capture.Sources instead")
+
+            source = PyKinectRuntime(PyKinectV2.FrameSourceTypes_Color | PyKinectV2.FrameSourceTypes_Body | PyKinectV2.FrameSourceTypes_Body )
+
+        self._kinect = source
 
         # Store references from the body tracking ID to a simpler 0-5 ID
         self._bodies = []
         self._body_stream = DataStream()
 
+        # If True, joints are stored as one row per body per frame in tbl_SkeletonData
+        self._packed = packed
+
         # This is our access to our database
         self._database = Database(DATABASE)
 
         # Unique performance ID (the last index + 1)
         self._p_id = self.get_performance_id()
 
+        # If True, the database, video and audio are written by separate processes
+        self._background = background
+
+        # Joint and hand rows are buffered and written in batched transactions
+        if self._background:
+            self._buffer = DatabaseWriterProcess(DATABASE, batch_size, batch_wait)
+            self._buffer.start()
+        else:
+            self._buffer = InsertBuffer(self._database, batch_size, batch_wait)
+
         # This is the descriptor for storing RGB video
         self._video_fn   = 'Output_%.03d.avi' % self._p_id
         self._video_path = VIDEO_DIR + self._video_fn
-        self._video = VideoWriter(self._video_path)
+        self._video_size = self._kinect.resolution
+        self._video = VideoWriterProcess(self._video_path, size=self._video_size) if self._background else ThreadedVideoWriter(self._video_path, size=self._video_size)
         self._video_stream = DataStream()
 
         # This the descriptor for storing audio data
         self._audio_path = AUDIO_DIR + 'Output_%.03d.wav' % self._p_id
-        self._audio = AudioWriter(self._audio_path)
+        self._audio = AudioWriterProcess(self._audio_path) if self._background else StreamingAudioWriter(self._audio_path)
         self._audio_stream  = DataStream()
+        self._audio_samples = []   # Number of samples in each audio frame
 
         # This is the descriptor for storing depth data
 
@@ -131,31 +159,115 @@ class KinectService():
             self._bodies.append(body_tracking_id)
         return self._bodies.index(body_tracking_id)
 
-    def get_body_frame(self):
-        """ Gets the last body frame data if it exists """
-        if self._kinect.has_new_body_frame():
-            return self._kinect.get_last_body_frame()
+    def get_body_frames(self):
+        """ Returns a list of the body frames received since the last call """
+        return self._kinect.get_new_body_frames()
+
+    def get_rgb_frames(self):
+        """ Returns a list of the colour frames received since the last call.
+            Each holds a BGRA image as 3D matrix and must be released """
+        return self._kinect.get_new_color_frames()
+
+    def get_audio_frames(self):
+        """ Returns a list of the audio frames (made of sub-frames of values
+            between -1.0 and 1.0) received since the last call """
+        return self._kinect.get_new_audio_frames()
+
+    @staticmethod
+    def pack_joints(joints, joints_2D):
+        """ Returns the positions, pixels and tracking states of a body's joints as blobs """
+        n = len(Skeleton.JointTypes)
+        positions = [(joints[j].Position.x, joints[j].Position.y, joints[j].Position.z) for j in range(n)]
+        pixels    = [(joints_2D[j].x, joints_2D[j].y) for j in range(n)]
+        tracking  = [joints[j].TrackingState for j in range(n)]
+        return pack_skeleton(positions, pixels, tracking)
+
+    def record_bodies(self, body_frame):
+        """ Adds the joint and hand data of each tracked body in a frame to the buffer """
+
+        self._body_stream.append( body_frame.timestamp() )
+
+        # Retrieve body data from the frame
+
+        for i in range(0, self._kinect.max_body_count):
+
+            body = body_frame.bodies[i]
+
+            if not body.is_tracked:
+
+                continue
+
+            # Get initial body data
+
+            body_index = self.body_index(body.tracking_id)
+
+            KeyData = (self._p_id, body_index, self._body_stream.last_frame_index())
+
+            # Get the x, y, z location of each joint in metres
+
+            joints = body.joints
+
+            joints_2D = self._kinect.body_joints_to_color_space(joints)
+
+            if self._packed:
+
+                # All 25 joints are packed into a single tbl_SkeletonData row
+
+                self._buffer.add(SKELETON_DATA_TABLE, KeyData + self.pack_joints(joints, joints_2D))
+
+            else:
+
+                # Rows are in tbl_JointData column order: performance_id, body, frame,
+                # joint_id, x, y, z, pixel_x, pixel_y, tracking_state
+
+                JointData = []
+
+                for j in range(len(Skeleton.JointTypes)):
+
+                    # Location in 3 dimensional space (m)
+
+                    pos = joints[j].Position
+
+                    # Location in 3 dimensional space (px)
+
+                    pos2 = joints_2D[j]
+
+                    # Data on whether the joint is tracked properly
+
+                    tracking_state = joints[j].TrackingState
+
+                    JointData.append(KeyData + (j, pos.x, pos.y, pos.z, pos2.x, pos2.y, tracking_state))
+
+                # Add data to JointData table
+
+                self._buffer.extend(JOINT_DATA_TABLE, JointData)
+
+            # body - > hand_xxxx_state & hand_xxxx_confidence
+
+            HandData = KeyData + (body.hand_left_state,  body.hand_left_confidence,
+                                  body.hand_right_state, body.hand_right_confidence)
+
+            # Add to HandData table
+
+            self._buffer.add(HAND_DATA_TABLE, HandData)
 
-    def get_rgb_frame(self):
-        """ Returns the RGB image of the frame as 3D matrix """
-        if self._kinect.has_new_color_frame():
-            return self._kinect.get_last_color_frame()
+            # Update timings
 
-    def get_audio_frame(self):
-        """ Returns a numpy array of values between -1.0 and 1.0
-            for the last frame (made of sub-frames) of audio received """
-        if self._kinect.has_new_audio_frame():
-            return self._kinect.get_last_audio_frame()
+            self.update_timings()
+
+        return
 
     ### Media I/O methods
             
     def add_to_audio(self, audio):
-        """ Add any new frames of audio to the accumulator """
+        """ Passes any new frames of audio to the writer and returns the number
+            of samples it queued, which leaves out any subframes it dropped """
+        samples = 0
         if audio is not None:
             for subframe in audio:
                 if subframe is not None:
-                    self._audio.add(subframe)
-        return
+                    samples += self._audio.add(subframe)
+        return samples
 
     ### Main Loop
         
@@ -169,10 +281,15 @@ class KinectService():
         # Store the streams being captured
 
         if getBodies: self._streams.append(self._body_stream)
-        if getAudio:  pass
+        if getAudio:  self._streams.append(self._audio_stream)
         if getVideo:  self._streams.append(self._video_stream)
         if getDepth:  pass
 
+        # Start the audio and video writers for the streams being captured
+
+        if getAudio: self._audio.start()
+        if getVideo: self._video.start()
+
         # Set up automated stepping of file
         
         if Clicking:
@@ -204,122 +321,66 @@ class KinectService():
                 self._done = True
 
                 continue
-                    
 
-            # BODY JOINTS
+            # If the frame source has nothing left to give
 
-            if getBodies:
-
-                body_frame = self.get_body_frame()
-
-                if self._body_stream.has_new_frame( body_frame ):
+            if self._kinect.exhausted():
 
-                    self._body_stream.append( body_frame.timestamp() )
+                self._done = True
 
-                    # Retrieve body data from the frame
+                continue
                     
-                    for i in range(0, self._kinect.max_body_count):
-                        
-                        body = body_frame.bodies[i]
-                        
-                        if not body.is_tracked:
-                            
-                            continue
-
-                        # Get initial body data
-
-                        body_index = self.body_index(body.tracking_id)
-
-                        KeyData = [('performance_id', self._p_id), ('body', body_index), ('frame', self._body_stream.last_frame_index())]
-
-                        # Get the x, y, z location of each joint in metres
-
-                        joints = body.joints
-                        
-                        joints_2D = self._kinect.body_joints_to_color_space(joints)
-
-                        for j in range(len(Skeleton.JointTypes)):
-
-                            JointData = KeyData
-
-                            # Joint ID
-
-                            JointData += [("joint_id", j)]
-
-                            # Location in 3 dimensional space (m)
-                            
-                            pos = joints[j].Position
-
-                            x, y, z = pos.x, pos.y, pos.z
-
-                            # Location in 3 dimensional space (px)
-
-                            pos2 = joints_2D[j]
 
-                            pixel_x, pixel_y = pos2.x, pos2.y
-
-                            JointData += [("x", x), ("y", y), ("z", z)]
-                            JointData += [("pixel_x", pixel_x),("pixel_y", pixel_y)]
-
-                            # Data on whether the joint is tracked properly
-
-                            tracking_state = joints[j].TrackingState
-
-                            JointData += [("tracking_state", tracking_state)]
-
-                            # Add data to JointData table
-
-                            self._database.insert(JOINT_DATA_TABLE, JointData)
+            # BODY JOINTS
 
-                        # body - > hand_xxxx_state & hand_xxxx_confidence
+            if getBodies:
 
-                        HandData = KeyData
+                for body_frame in self.get_body_frames():
 
-                        L_HandState = body.hand_left_state
-                        L_HandConf  = body.hand_left_confidence
+                    if self._body_stream.has_new_frame( body_frame ):
 
-                        HandData += [("left_hand_state", L_HandState),("left_hand_confidence", L_HandConf)]
+                        self.record_bodies(body_frame)
 
-                        R_HandState = body.hand_right_state
-                        R_HandConf  = body.hand_right_confidence
+            # AUDIO
 
-                        HandData += [("right_hand_state", R_HandState),("right_hand_confidence", R_HandConf)]
+            if getAudio:
 
-                        # Add to HandData table
+                for audio_frame in self.get_audio_frames():         # Get frames
 
-                        self._database.insert(HAND_DATA_TABLE, HandData)
+                    if self._audio_stream.has_new_frame( audio_frame ):
 
-                        # Update timings
+                        samples = self.add_to_audio(audio_frame.data())     # Write
 
-                        self.update_timings()
+                        # Frames that were dropped entirely are left out of tbl_AudioTime
 
-            # AUDIO
+                        if samples > 0:
 
-            if getAudio:
+                            self._audio_stream.append(audio_frame.timestamp())  # Get timestamp
 
-                audio_frame = self.get_audio_frame()                # Get frame
+                            self._audio_samples.append(samples)
 
-                if self._audio_stream.has_new_frame( audio_frame ):
+                        self.update_timings()                               # Update timings
 
-                    self.add_to_audio(audio_frame.data())               # Write
+            # RGB VIDEO
 
-                    self._audio_stream.append(audio_frame.timestamp())  # Get timestamp
+            if getVideo:
 
-                    self.update_timings()                               # Update timings
+                for rgb_frame in self.get_rgb_frames():             # Get frames
 
-            # RGB VIDEO
+                    if self._video_stream.has_new_frame( rgb_frame ):
 
-            if getVideo:
+                        # Write, releasing the frame's buffer once encoded. Only frames that
+                        # are in the video get a timestamp so tbl_VideoTime matches the file
 
-                rgb_frame = self.get_rgb_frame()                    # Get frame
+                        if self._video.write(rgb_frame.data(), rgb_frame.release):
 
-                if self._video_stream.has_new_frame( rgb_frame ):
+                            self._video_stream.append( rgb_frame.timestamp() )  # Get timestamp
 
-                    self._video.write(rgb_frame.data())                 # Write
+                        self.update_timings()                               # Update timings
 
-                    self._video_stream.append( rgb_frame.timestamp() )  # Get timestamp
+                    else:
 
-                    self.update_timings()                               # Update timings
+                        rgb_frame.release()
 
             #: Every loop, set the _last_frame_time attribute to the largest time in the streams
 
@@ -352,12 +413,41 @@ class KinectService():
 
         # Add the start/end times of streams to database
         self.store_media_times(getBodies, getAudio, getVideo)
+
+        # Write any rows still held in the buffer
+        if self._background:
+            self._buffer.wait_for_flush()
+        else:
+            self._buffer.flush()
+
+        # Report any frames dropped by the writer processes
+        for name, stats in self.writer_stats().items():
+            if stats["dropped"] > 0:
+                print "%s writer dropped %d of %d frames" % (name, stats["dropped"], stats["dropped"] + stats["queued"])
+
+        # And any frames the frame source lost before they were read
+        for name, stats in self._kinect.ring_stats().items():
+            if stats["overwritten"] + stats["dropped"] > 0:
+                print "%s stream lost %d of %d frames" % (name, stats["overwritten"] + stats["dropped"], stats["published"] + stats["dropped"])
         
         return
+
+    def writer_stats(self):
+        """ Returns a dict of stream name -> queued/written/dropped counters
+            for each writer (video and audio only if not writing in the background) """
+        if not self._background:
+            return {"video": self._video.stats(), "audio": self._audio.stats()}
+        return {"body": self._buffer.stats(), "video": self._video.stats(), "audio": self._audio.stats()}
         
     def NameRecording(self, name):
         """ Enter a string name for the recording database """
-        self._database.insert(PERFORMANCE_NAME_TABLE, [("performance_id", self._p_id),("name", name)])
+        self.insert(PERFORMANCE_NAME_TABLE, [("performance_id", self._p_id),("name", name)])
+        return
+
+    def insert(self, table, data):
+        """ Adds a row (list of tuples (col, data)) to the buffer so that all
+            writes to the database go through the same connection """
+        self._buffer.add(table, self._database.row(table, data))
         return
 
     def store_media_times(self, body, audio, video):
@@ -365,32 +455,38 @@ class KinectService():
         if body:
             self.write_stream_timestamps(BODY_TIME_TABLE, self._body_stream)
         if audio:
-            self._database.insert(AUDIO_PATH_TABLE, [("performance_id", self._p_id), ("audio_id", 0), ("path", self._audio_path), ("start_time", self._audio_stream.start_time())])
+            self.insert(AUDIO_PATH_TABLE, [("performance_id", self._p_id), ("audio_id", 0), ("path", self._audio_path), ("start_time", self._audio_stream.start_time())])
+            self.write_audio_timestamps()
         if video:
-            self._database.insert(VIDEO_PATH_TABLE, [("performance_id", self._p_id), ("video_id", 0), ("path", self._video_fn), ("start_time", self._video_stream.start_time())])
+            self.insert(VIDEO_PATH_TABLE, [("performance_id", self._p_id), ("video_id", 0), ("path", self._video_fn), ("start_time", self._video_stream.start_time())])
             self.write_stream_timestamps(VIDEO_TIME_TABLE, self._video_stream)
         return
 
     def write_bodies(self):
         """ Stores an ID number for each body that appeared in the scene - can be edited later """
         for n in self._bodies:
-            self._database.insert(BODY_NAME_TABLE, [("performance_id", self._p_id), ("body", n), ("name", n)])
+            self.insert(BODY_NAME_TABLE, [("performance_id", self._p_id), ("body", n), ("name", n)])
         return
 
     def write_stream_timestamps(self, table, stream):
         """ FRAME_TIME_TABLE """
 
-        for frame, time in stream.items(): 
+        self._buffer.extend(table, [(self._p_id, frame, time) for frame, time in stream.items()])
+
+        return
 
-            timestamp = [('performance_id', self._p_id), ('frame', frame), ('time', time )]
+    def write_audio_timestamps(self):
+        """ AUDIO_TIME_TABLE - the start time of each frame of audio and its end, from the samples the writer queued """
 
-            self._database.insert(table, timestamp)
+        self._buffer.extend(AUDIO_TIME_TABLE, [(self._p_id, time, time + samples / float(AUDIO_RATE))
+                                               for time, samples in zip(self._audio_stream.timestamps, self._audio_samples)])
 
         return
 
     def close(self):
         """ Closes any open files """
         self._kinect.close()
+        self._buffer.close()
         self._database.save()
         self._database.close()
         return
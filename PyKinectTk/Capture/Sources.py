@@ -0,0 +1,421 @@
+"""
+    Sources.py
+
+    Frame sources that can be used by KinectService in place of the
+    Kinect runtime. A frame source provides the same methods as
+    PyKinectRuntime:
+
+        has_new_body_frame()    get_last_body_frame()
+        has_new_color_frame()   get_last_color_frame()
+        has_new_audio_frame()   get_last_audio_frame()
+
+        get_new_body_frames()   get_new_color_frames()   get_new_audio_frames()
+
+        body_joints_to_color_space(joints)
+        max_body_count, resolution, exhausted(), close()
+
+    Colour frames may share a buffer with the source, so whoever gets
+    one calls its release() method once they are done with it.
+
+    SyntheticSource generates moving skeletons, video and audio and
+    ReplaySource reads frames back out of the Recordings.db database,
+    so capture can be tested without the Windows Kinect service.
+"""
+
+# Utility modules
+from ..utils import *
+from ..utils.SQL import *
+
+from time import time as now
+
+import numpy as np
+import cv2
+
+KINECT_MAX_BODY_COUNT = 6
+
+# Frame data - mirror the objects given by PyKinectRuntime
+
+class Point(object):
+    __slots__ = ('x', 'y', 'z')
+    def __init__(self, x, y, z=0.0):
+        self.x = x
+        self.y = y
+        self.z = z
+
+class SourceJoint(object):
+    __slots__ = ('Position', 'TrackingState', 'Pixel')
+    def __init__(self, position, tracking_state, pixel=None):
+        self.Position = position
+        self.TrackingState = tracking_state
+        self.Pixel = pixel
+
+class SourceBody(object):
+    """ Same attributes as PyKinectRuntime.KinectBody """
+    def __init__(self, tracking_id=-1, joints=None, hands=(0, 0.0, 0, 0.0)):
+        self.tracking_id = tracking_id
+        self.is_tracked  = joints is not None
+        self.joints = joints
+        self.hand_left_state, self.hand_left_confidence, self.hand_right_state, self.hand_right_confidence = hands
+
+class SourceBodyFrame(object):
+    """ Same interface as PyKinectRuntime.KinectBodyFrameData """
+    def __init__(self, bodies, relative_time):
+        self.bodies = bodies
+        self.relative_time = relative_time
+
+    def timestamp(self):
+        return self.relative_time
+
+class SourceFrame(object):
+    """ Same interface as KinectVideoFrameData / KinectAudioFrameData. If
+        data is in a PooledFrame, frame is given and release() returns it """
+    def __init__(self, data, relative_time, frame=None):
+        self.array = data
+        self.time  = relative_time
+        self.frame = frame
+
+    def timestamp(self):
+        return self.time
+
+    def data(self):
+        return self.array
+
+    def retain(self):
+        if self.frame is not None:
+            self.frame.retain()
+        return self
+
+    def release(self):
+        if self.frame is not None:
+            self.frame.release()
+        return
+
+# Frame sources
+
+class FrameSource(object):
+    """ Base class for frame sources. Each stream ('body', 'color' and 'audio')
+        has a number of frames given by length(stream) and the next frame is
+        made ready either straight away or, if realtime is True, when its
+        timestamp is reached by the wall clock """
+
+    max_body_count = KINECT_MAX_BODY_COUNT
+
+    resolution = 1920, 1080
+
+    def __init__(self, fps=30.0, realtime=False):
+
+        self._fps = float(fps)
+        self._realtime = realtime
+        self._start = None
+
+        #: Dictionary of stream name -> index of the next frame to give
+        self._next = {"body": 0, "color": 0, "audio": 0}
+
+    # Over-ridden by sub-classes
+
+    def length(self, stream):
+        """ Returns the number of frames in stream """
+        return 0
+
+    def time_of(self, stream, n):
+        """ Returns the time (seconds) of frame n in stream """
+        return n / self._fps
+
+    def body_frame(self, n):
+        return None
+
+    def color_frame(self, n):
+        return None
+
+    def audio_frame(self, n):
+        return None
+
+    def body_joints_to_color_space(self, joints):
+        return [joint.Pixel for joint in joints]
+
+    # Frame source interface
+
+    def due(self, stream):
+        """ Returns True if the next frame in stream is ready """
+        n = self._next[stream]
+        if n >= self.length(stream):
+            return False
+        if not self._realtime:
+            return True
+        if self._start is None:
+            self._start = now() - self.time_of(stream, n)
+        return now() - self._start >= self.time_of(stream, n)
+
+    def advance(self, stream):
+        """ Returns the index of the next frame in stream and moves on """
+        n = self._next[stream]
+        self._next[stream] += 1
+        return n
+
+    def timestamp(self, stream, n):
+        """ Relative time of frame n in the same units as the Kinect runtime """
+        return int(round(self.time_of(stream, n) * TIME_DIV))
+
+    def has_new_body_frame(self):
+        return self.due("body")
+
+    def has_new_color_frame(self):
+        return self.due("color")
+
+    def has_new_audio_frame(self):
+        return self.due("audio")
+
+    def get_last_body_frame(self):
+        return self.body_frame(self.advance("body"))
+
+    def get_last_color_frame(self):
+        return self.color_frame(self.advance("color"))
+
+    def get_last_audio_frame(self):
+        return self.audio_frame(self.advance("audio"))
+
+    def new_frames(self, stream, get):
+        """ Returns a list of the frames in stream that are due, or just the
+            next one if not running in real time """
+        frames = []
+        while self.due(stream):
+            frame = get()
+            if frame is not None:
+                frames.append(frame)
+            if not self._realtime:
+                break
+        return frames
+
+    def get_new_body_frames(self):
+        return self.new_frames("body", self.get_last_body_frame)
+
+    def get_new_color_frames(self):
+        return self.new_frames("color", self.get_last_color_frame)
+
+    def get_new_audio_frames(self):
+        return self.new_frames("audio", self.get_last_audio_frame)
+
+    def ring_stats(self):
+        """ Frames are made when asked for so none are ever overwritten """
+        return {}
+
+    def exhausted(self):
+        """ Returns True once every frame of every stream has been given """
+        return all(self._next[stream] >= self.length(stream) for stream in self._next)
+
+    def close(self):
+        return
+
+# Position (m) of each joint, relative to SpineBase, for a person standing still
+
+STANDING = np.array([( 0.00,  0.00, 0.00), ( 0.00,  0.30, 0.00), ( 0.00,  0.60, 0.00), ( 0.00,  0.75, 0.00),
+                     (-0.18,  0.52, 0.00), (-0.30,  0.30, 0.00), (-0.35,  0.08, 0.00), (-0.36,  0.00, 0.00),
+                     ( 0.18,  0.52, 0.00), ( 0.30,  0.30, 0.00), ( 0.35,  0.08, 0.00), ( 0.36,  0.00, 0.00),
+                     (-0.08, -0.02, 0.00), (-0.10, -0.45, 0.00), (-0.10, -0.85, 0.00), (-0.10, -0.90, 0.08),
+                     ( 0.08, -0.02, 0.00), ( 0.10, -0.45, 0.00), ( 0.10, -0.85, 0.00), ( 0.10, -0.90, 0.08),
+                     ( 0.00,  0.52, 0.00), (-0.37, -0.08, 0.00), (-0.33,  0.00, 0.03), ( 0.37, -0.08, 0.00),
+                     ( 0.33,  0.00, 0.03)])
+
+# Joints that swing with the left and right arms
+
+LEFT_ARM  = [5, 6, 7, 21, 22]
+RIGHT_ARM = [9, 10, 11, 23, 24]
+
+class SyntheticSource(FrameSource):
+    """ Generates frames for a number of bodies (up to 6) moving in front
+        of the camera. frames is the number of frames in each stream and
+        the colour and audio streams can be switched off """
+
+    def __init__(self, bodies=1, fps=30.0, resolution=(1920, 1080), frames=300, video=True, audio=False, realtime=False):
+
+        FrameSource.__init__(self, fps, realtime)
+
+        if not 0 < bodies <= self.max_body_count:
+
+            raise ValueError("bodies must be between 1 and %d" % self.max_body_count)
+
+        self._num_bodies = bodies
+        self._frames = frames
+
+        self.resolution = self._width, self._height = resolution
+
+        self._video = video
+        self._audio = audio
+
+        # Colour camera focal length (px) scaled from the 1920 x 1080 Kinect camera
+        self._focal = 1060.0 * self._width / 1920
+
+        # Each body stands in its own place
+        self._offset = np.array([((b - (bodies - 1) / 2.0) * 0.8, 0.0, 2.5 + 0.3 * (b % 2)) for b in range(bodies)])
+
+        # Background image for the colour stream (BGRA)
+        self._background = np.zeros((self._height, self._width, 4), np.uint8)
+        self._background[:, :, 0] = np.linspace(0, 255, self._width).astype(np.uint8)
+        self._background[:, :, 3] = 255
+
+        # Colour frames are drawn into pooled buffers, like the Kinect runtime
+        self._color_pool = FramePool(self._background.shape, np.uint8)
+
+        # Audio frames are made of 256 sample sub-frames at 16kHz
+        self._subframe_length = 256
+        self._subframes = int(np.ceil(16000 / self._fps / self._subframe_length))
+
+    def length(self, stream):
+        if stream == "color" and not self._video:
+            return 0
+        if stream == "audio" and not self._audio:
+            return 0
+        return self._frames
+
+    def positions(self, n):
+        """ Returns an array of joint positions (bodies, 25, 3) at frame n """
+        t = self.time_of("body", n)
+        phase = 2 * np.pi * 0.5 * t + np.arange(self._num_bodies)
+        pos = STANDING[np.newaxis] + self._offset[:, np.newaxis]
+        pos[:, :, 0] += 0.1 * np.sin(phase / 4)[:, np.newaxis]
+        pos[:, LEFT_ARM, 2]  -= 0.3 * (1 + np.sin(phase))[:, np.newaxis]
+        pos[:, RIGHT_ARM, 2] -= 0.3 * (1 + np.cos(phase))[:, np.newaxis]
+        return pos
+
+    def pixels(self, positions):
+        """ Projects an array of positions (..., 3) onto the colour camera """
+        px = self._width  / 2.0 + self._focal * positions[..., 0] / positions[..., 2]
+        py = self._height / 2.0 - self._focal * positions[..., 1] / positions[..., 2]
+        return np.dstack((px, py))
+
+    def body_frame(self, n):
+
+        pos = self.positions(n)
+        pix = self.pixels(pos).reshape(pos.shape[:2] + (2,))
+
+        bodies = np.ndarray((self.max_body_count,), dtype=np.object)
+
+        for b in range(self.max_body_count):
+
+            if b < self._num_bodies:
+
+                joints = [SourceJoint(Point(*pos[b, j]), 2, Point(*pix[b, j])) for j in range(len(STANDING))]
+
+                bodies[b] = SourceBody(b, joints, (2, 1.0, 3, 1.0))
+
+            else:
+
+                bodies[b] = SourceBody()
+
+        return SourceBodyFrame(bodies, self.timestamp("body", n))
+
+    def color_frame(self, n):
+        frame = self._color_pool.acquire()
+        image = frame.array
+        np.copyto(image, self._background)
+        row = (n * 8) % self._height
+        image[row:row + 8, :, 1] = 255
+        return SourceFrame(image, self.timestamp("color", n), frame)
+
+    def audio_frame(self, n):
+        t = self.time_of("audio", n) + np.arange(self._subframes * self._subframe_length) / 16000.0
+        samples = (0.5 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)
+        subframes = np.ndarray((self._subframes,), dtype=np.ndarray)
+        for i in range(self._subframes):
+            subframes[i] = samples[i * self._subframe_length:(i + 1) * self._subframe_length]
+        return SourceFrame(subframes, self.timestamp("audio", n))
+
+
+class ReplaySource(FrameSource):
+    """ Gives the body frames and video of a recording in the
+        database as if they were coming from the Kinect """
+
+    def __init__(self, p_id, video=True, realtime=False):
+
+        FrameSource.__init__(self, 30.0, realtime)
+
+        with Database(DATABASE) as db:
+
+            rows  = db.query(JOINT_DATA_TABLE, p_id)
+            packed = db.query(SKELETON_DATA_TABLE, p_id) if SKELETON_DATA_TABLE in db.tables() else []
+            hands = db.query(HAND_DATA_TABLE, p_id)
+            times = db.query(BODY_TIME_TABLE, p_id)
+
+            video_times = db.query(VIDEO_TIME_TABLE, p_id) if video else []
+
+        # Frame numbers and times for each stream
+
+        self._body_frames = sorted((row['frame'], row['time']) for row in times)
+        self._color_frames = sorted((row['frame'], row['time']) for row in video_times)
+
+        # Dictionary of frame -> body -> list of joint rows (or a packed skeleton row)
+
+        self._joints = {}
+
+        for row in rows:
+
+            self._joints.setdefault(row['frame'], {}).setdefault(row['body'], []).append(row)
+
+        for row in packed:
+
+            self._joints.setdefault(row['frame'], {})[row['body']] = row
+
+        # Dictionary of (frame, body) -> hand data
+
+        self._hands = dict(((row['frame'], row['body']), (row['left_hand_state'], row['left_hand_confidence'],
+                                                         row['right_hand_state'], row['right_hand_confidence'])) for row in hands)
+
+        self._video = None
+
+        if self._color_frames:
+
+            from ..Playback.Readers import VideoReader
+
+            self._video = VideoReader(p_id)
+
+    def length(self, stream):
+        if stream == "body":
+            return len(self._body_frames)
+        if stream == "color":
+            return len(self._color_frames)
+        return 0
+
+    def time_of(self, stream, n):
+        return (self._body_frames if stream == "body" else self._color_frames)[n][1]
+
+    def body_frame(self, n):
+
+        frame = self._body_frames[n][0]
+
+        bodies = np.ndarray((self.max_body_count,), dtype=np.object)
+
+        for b in range(self.max_body_count):
+
+            bodies[b] = SourceBody()
+
+        for b, rows in self._joints.get(frame, {}).items():
+
+            if type(rows) is list:
+
+                rows = sorted(rows, key=lambda row: row['joint_id'])
+
+                joints = [SourceJoint(Point(row['x'], row['y'], row['z']), row['tracking_state'], Point(row['pixel_x'], row['pixel_y'])) for row in rows]
+
+            else:
+
+                positions, pixels, tracking = [a.tolist() for a in unpack_skeleton(rows['positions'], rows['pixels'], rows['tracking_states'])]
+
+                joints = [SourceJoint(Point(*xyz), state, Point(*xy)) for xyz, xy, state in zip(positions, pixels, tracking)]
+
+            bodies[b % self.max_body_count] = SourceBody(b, joints, self._hands.get((frame, b), (0, 0.0, 0, 0.0)))
+
+        return SourceBodyFrame(bodies, self.timestamp("body", n))
+
+    def color_frame(self, n):
+        try:
+            image = self._video.read()
+        except StopIteration:
+            # The video file has fewer frames than were timestamped
+            self._color_frames = self._color_frames[:n]
+            return None
+        return SourceFrame(cv2.cvtColor(image, cv2.COLOR_BGR2BGRA), self.timestamp("color", n))
+
+    def close(self):
+        if self._video is not None:
+            self._video.close()
+        return
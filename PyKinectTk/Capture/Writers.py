@@ -1,36 +1,107 @@
 """ Wrapper for OpenCV2 Video Writer """
 
 from cv2 import VideoWriter as writer
-from cv2 import VideoWriter_fourcc, destroyAllWindows
-from numpy import array, concatenate
+from cv2 import VideoWriter_fourcc, cvtColor, COLOR_BGRA2BGR
+from numpy import array, asarray, empty, concatenate, clip, float32, uint8
 from threading import Thread
-from multiprocessing import Process, Queue, Lock
+from multiprocessing import Process, Queue, Lock, Event, Value
+from timeit import default_timer as clock
+from Queue import Full, Empty
+from Queue import Queue as LocalQueue
 import wave
 
+from ..utils.SQL import Database, InsertBuffer
+
 
 class VideoWriter:
     """ Holds a queue of frames to write to disk. """
 
-    def __init__(self, path, fps=30.0):
+    def __init__(self, path, fps=30.0, size=(1920,1080)):
 
         fourcc    = VideoWriter_fourcc(*"XVID")
         self.path = path
-        self.data = writer(self.path, fourcc, fps, (1920,1080))
+        self.data = writer(self.path, fourcc, fps, size)
 
     def __str__(self):
         return self.path
 
-    def write(self, data):
+    def write(self, data, done=None):
+        """ Writes a BGR frame, or a BGRA frame from the Kinect, then calls done().
+            Returns True as the frame is never dropped """
+        if data.ndim == 3 and data.shape[2] == 4:
+            data = cvtColor(data, COLOR_BGRA2BGR)
         self.data.write(data)
-        return
+        if done is not None:
+            done()
+        return True
 
     def release(self):
         self.data.release()
-        destroyAllWindows()
         return
 
 class ThreadedVideoWriter(VideoWriter, Thread):
-    pass
+    """ Converts and encodes video frames in a background thread so write()
+        only has to queue them. When the queue is full, write() waits up to
+        timeout seconds for room (forever if timeout is None) and drops the
+        frame if there is none. Frames are not copied so must not be changed
+        until done() is called, once the frame is encoded or dropped """
+
+    def __init__(self, path, fps=30.0, size=(1920,1080), maxsize=30, timeout=0.5):
+        VideoWriter.__init__(self, path, fps, size)
+        Thread.__init__(self)
+
+        self.daemon = True
+
+        self.queue   = LocalQueue(maxsize)
+        self.timeout = timeout
+
+        self.queued  = 0
+        self.dropped = 0
+        self.written = 0
+
+        # Queue depth after each write and seconds from write() to encoded
+
+        self._depth   = [0, 0]      # total, max
+        self._latency = [0.0, 0.0]  # total, max
+
+    def write(self, data, done=None):
+        """ Queues a frame, returns False if it was dropped """
+        try:
+            self.queue.put((data, clock(), done), self.timeout != 0, self.timeout or None)
+        except Full:
+            self.dropped += 1
+            if done is not None:
+                done()
+            return False
+        self.queued += 1
+        depth = self.queue.qsize()
+        self._depth[0] += depth
+        self._depth[1] = max(self._depth[1], depth)
+        return True
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            VideoWriter.write(self, item[0], item[2])
+            latency = clock() - item[1]
+            self._latency[0] += latency
+            self._latency[1] = max(self._latency[1], latency)
+            self.written += 1
+
+    def stats(self):
+        return {"queued": self.queued, "written": self.written, "dropped": self.dropped,
+                "mean_depth": float(self._depth[0]) / max(self.queued, 1), "max_depth": self._depth[1],
+                "mean_latency": self._latency[0] / max(self.written, 1), "max_latency": self._latency[1]}
+
+    def release(self):
+        """ Encodes any queued frames and closes the file """
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
+        VideoWriter.release(self)
+        return
                 
 
 class DepthWriter:
@@ -45,11 +116,31 @@ class DepthWriter:
         return
 
 
+#: Kinect audio is mono, 32-bit float samples at 16kHz
+AUDIO_RATE = 16000
+
+def pcm(samples, sampwidth=4):
+    """ Converts float samples between -1.0 and 1.0 to little-endian
+        signed PCM bytes (unsigned for 8-bit) of sampwidth bytes per sample """
+    if sampwidth not in (1, 2, 4):
+        raise ValueError("sampwidth must be 1, 2 or 4 bytes")
+    scale = float(1 << (8 * sampwidth - 1)) - 1
+    samples = clip(samples, -1.0, 1.0) * scale
+    if sampwidth == 1:
+        return (samples + 128).astype(uint8).tostring()
+    return samples.astype("<i%d" % sampwidth).tostring()
+
 class AudioWriter:
+    """ Collects audio subframes into fixed size float32 chunks and writes
+        them to a WAV file of signed PCM samples. Adding a subframe only
+        copies it into the current chunk so the cost of a recording grows
+        linearly with its length """
 
-    def __init__(self, path):
+    def __init__(self, path, chunk_size=1 << 18):
 
-        self.data = array([])
+        self.chunks = []
+        self.chunk_size = chunk_size
+        self.size = 0
         self.path = path
         self.start = None
         self.offset = None
@@ -57,23 +148,345 @@ class AudioWriter:
         self.subframes = 0
 
     def add(self, array):
-        """ Add data """
-        self.data = concatenate((self.data, array))
+        """ Add data, returns the number of samples added """
+        array = asarray(array, float32).ravel()
+
+        added = len(array)
+
+        while len(array):
+
+            used = self.size % self.chunk_size
+
+            if used == 0:
+                self.chunks.append(empty(self.chunk_size, float32))
+
+            n = min(len(array), self.chunk_size - used)
+
+            self.chunks[-1][used:used + n] = array[:n]
+
+            array = array[n:]
+
+            self.size += n
+
+        self.subframes += 1
+
+        return added
+
+    def samples(self):
+        """ Returns every sample added so far as one float32 array """
+        data = concatenate(self.chunks) if self.chunks else empty(0, float32)
+        return data[:self.size]
+
+    def nbytes(self):
+        """ Returns the memory held by the chunks """
+        return sum(chunk.nbytes for chunk in self.chunks)
 
     def write(self, **kwargs):
 
         # Parameters
         nchannels = kwargs.get('nchannels', 1)
         sampwidth = kwargs.get('sampwidth', 4)
-        framerate = kwargs.get('framerate', 32000.0)
+        framerate = kwargs.get('framerate', AUDIO_RATE)
+
+        f = wave.open(self.path, "wb")
+        f.setparams((nchannels, sampwidth, framerate, self.size // nchannels, "NONE", "NONE"))
 
-        self.data.tostring()
-        
-        if self.data is not None:
-            f = wave.open(self.path, "wb")
-            f.setparams((nchannels, sampwidth, framerate, self.data.size, "NONE", "NONE"))
-            f.writeframes(self.data.tostring())
-            f.close()
+        # Write each chunk in turn rather than joining them first
+
+        for i, chunk in enumerate(self.chunks):
+            end = min(self.chunk_size, self.size - i * self.chunk_size)
+            f.writeframes(pcm(chunk[:end], sampwidth))
+
+        f.close()
+
+    def release(self):
+        self.chunks = []
+        self.size = 0
+        return
+
+
+class WaveStream:
+    """ Appends float samples to a WAV file as signed PCM. The header is
+        patched and the file flushed after every write, so everything
+        written so far can be read back if the capture stops early """
+
+    def __init__(self, path, nchannels=1, sampwidth=4, framerate=AUDIO_RATE):
+
+        self.path = path
+        self.sampwidth = sampwidth
+        self.size = 0
+
+        self._file = open(path, "wb")
+
+        self.wave = wave.open(self._file, "wb")
+        self.wave.setparams((nchannels, sampwidth, framerate, 0, "NONE", "NONE"))
+
+    def write(self, samples):
+        self.wave.writeframes(pcm(samples, self.sampwidth))
+        self._file.flush()
+        self.size += len(samples)
+
+    def close(self):
+        self.wave.close()
+        self._file.close()
+
+class StreamingAudioWriter(Thread):
+    """ Writes audio subframes to a WAV file from a background thread as they
+        are added, so memory use stays flat however long the recording is.
+        The file is opened by start() and closed by write(). add() waits up to
+        timeout seconds for room in the queue (forever if timeout is None) and
+        drops the subframe if there is none. Keyword arguments are passed on
+        to WaveStream """
+
+    def __init__(self, path, maxsize=512, timeout=0.5, block=4096, **kwargs):
+        Thread.__init__(self)
+
+        self.daemon = True
+
+        self.path    = path
+        self.params  = kwargs
+        self.block   = block     # Most samples joined into one write
+        self.queue   = LocalQueue(maxsize)
+        self.timeout = timeout
+
+        self.queued  = 0
+        self.dropped = 0
+        self.written = 0
+
+        self._stream = None
+
+    def start(self):
+        self._stream = WaveStream(self.path, **self.params)
+        Thread.start(self)
+
+    def add(self, data):
+        """ Queues a subframe, returns the number of samples queued (0 if it was dropped) """
+        data = array(data, float32).ravel()
+        try:
+            self.queue.put(data, self.timeout != 0, self.timeout or None)
+        except Full:
+            self.dropped += 1
+            return 0
+        self.queued += 1
+        return len(data)
+
+    def run(self):
+        done = False
+        while not done:
+            blocks = [self.queue.get()]
+            if blocks[0] is None:
+                break
+            # Join any other waiting subframes into one write
+            size = len(blocks[0])
+            while size < self.block:
+                try:
+                    item = self.queue.get_nowait()
+                except Empty:
+                    break
+                if item is None:
+                    done = True
+                    break
+                blocks.append(item)
+                size += len(item)
+            self._stream.write(concatenate(blocks))
+            self.written += len(blocks)
+        self._stream.close()
+
+    def stats(self):
+        return {"queued": self.queued, "written": self.written, "dropped": self.dropped}
+
+    def write(self):
+        """ Writes any queued subframes and closes the file """
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
+        return
 
     def release(self):
         return
+
+
+# Writers that run in their own process and are fed through a bounded queue
+
+FLUSH = "FLUSH"
+
+class WriterProcess(Process):
+    """ Base class for consuming items from a bounded queue in a separate
+        process. put() waits up to timeout seconds for room in the queue
+        (forever if timeout is None) and drops the item if there is none """
+
+    def __init__(self, maxsize=64, timeout=None):
+        Process.__init__(self)
+
+        self.daemon = True
+
+        self.queue   = Queue(maxsize)
+        self.timeout = timeout
+
+        # Counters in this process
+        self.queued  = 0
+        self.dropped = 0
+
+        # Counter updated by the worker process
+        self.written = Value('l', 0)
+
+        self._flushed = Event()
+
+    def put(self, item):
+        """ Adds an item to the queue, returns False if it was dropped """
+        try:
+            self.queue.put(item, self.timeout != 0, self.timeout or None)
+        except Full:
+            self.dropped += 1
+            return False
+        self.queued += 1
+        return True
+
+    def stats(self):
+        return {"queued": self.queued, "written": self.written.value, "dropped": self.dropped}
+
+    def run(self):
+        """ Main loop of the worker process """
+        self.setup()
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if isinstance(item, str):
+                self.command(item)
+                continue
+            self.handle(item)
+            with self.written.get_lock():
+                self.written.value += 1
+        self.finish()
+
+    def wait_for_flush(self):
+        """ Blocks until every item queued so far has been handled and flushed """
+        self._flushed.clear()
+        self.queue.put(FLUSH)
+        while not self._flushed.wait(0.5):
+            if not self.is_alive():
+                raise RuntimeError("%s exited before flushing its queue" % self.name)
+        return
+
+    def stop(self):
+        """ Signals the worker to finish the queue and waits for it to exit """
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
+        return
+
+    # Over-ridden by sub-classes - these are called in the worker process
+
+    def command(self, name):
+        """ Handles a control message put on the queue """
+        if name == FLUSH:
+            self.flush()
+            self._flushed.set()
+        return
+
+    def setup(self):
+        return
+
+    def handle(self, item):
+        return
+
+    def flush(self):
+        return
+
+    def finish(self):
+        return
+
+
+class DatabaseWriterProcess(WriterProcess):
+    """ Writes (table, rows) items to the database using an InsertBuffer.
+        Rows are never dropped: put() blocks when the queue is full """
+
+    def __init__(self, path, batch_size=2000, batch_wait=1.0, maxsize=256):
+        WriterProcess.__init__(self, maxsize, timeout=None)
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+
+    def add(self, table, row):
+        self.put((table, [row]))
+
+    def extend(self, table, rows):
+        self.put((table, rows))
+
+    def close(self):
+        self.stop()
+
+    def setup(self):
+        self._database = Database(self.path)
+        self._buffer   = InsertBuffer(self._database, self.batch_size, self.batch_wait)
+
+    def handle(self, item):
+        self._buffer.extend(*item)
+
+    def flush(self):
+        self._buffer.flush()
+
+    def finish(self):
+        self._buffer.flush()
+        self._database.close()
+
+
+class VideoWriterProcess(WriterProcess):
+    """ Encodes video frames in a separate process. Frames are dropped
+        if the queue stays full for longer than timeout seconds """
+
+    def __init__(self, path, fps=30.0, size=(1920,1080), maxsize=30, timeout=0.5):
+        WriterProcess.__init__(self, maxsize, timeout)
+        self.path = path
+        self.fps  = fps
+        self.size = size
+
+    def __str__(self):
+        return self.path
+
+    def write(self, data, done=None):
+        """ Queues a frame, returns False if it was dropped """
+        # The queue pickles frames in a feeder thread so copy any that are about to be re-used
+        if done is not None:
+            data = data.copy()
+            done()
+        return bool(self.put(data))
+
+    def release(self):
+        self.stop()
+
+    def setup(self):
+        self._video = VideoWriter(self.path, self.fps, self.size)
+
+    def handle(self, item):
+        self._video.write(item)
+
+    def finish(self):
+        self._video.release()
+
+
+class AudioWriterProcess(WriterProcess):
+    """ Writes audio subframes to a WAV file in a separate process as they
+        arrive. Keyword arguments are passed on to WaveStream """
+
+    def __init__(self, path, maxsize=512, timeout=0.5, **kwargs):
+        WriterProcess.__init__(self, maxsize, timeout)
+        self.path = path
+        self.params = kwargs
+
+    def add(self, data):
+        """ Queues a subframe, returns the number of samples queued (0 if it was dropped) """
+        return len(data) if self.put(data) else 0
+
+    def write(self):
+        self.stop()
+
+    def setup(self):
+        self._audio = WaveStream(self.path, **self.params)
+
+    def handle(self, item):
+        self._audio.write(asarray(item, float32).ravel())
+
+    def finish(self):
+        self._audio.close()
@@ -1 +1,2 @@
 from DataCapture import *
+from Sources import *
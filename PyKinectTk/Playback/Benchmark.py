@@ -0,0 +1,234 @@
+"""
+    Benchmark.py
+
+    Measures how quickly KinectDataPlayer renders frames and how many
+    frame buffers it allocates doing so, with and without reusing its
+    buffers. Minor page faults per frame are also given, as touching
+    newly allocated memory causes them (on Unix only, they are given as
+    null elsewhere). The frames are rendered but not shown on screen.
+
+    Unless a recording is given, a synthetic one is made in the working
+    environment (body data from a SyntheticSource and an XVID video of
+    its colour frames) and deleted afterwards.
+
+    Usage:
+
+        python -m PyKinectTk.Playback.Benchmark [options]
+
+    Options:
+
+    --performance <id>  :   Recording to play back. Default is a synthetic recording.
+    --bodies <n>        :   Number of bodies in the synthetic recording. Default is 2.
+    --frames <n>        :   Number of frames in the synthetic recording. Default is 300.
+    --size <w> <h>      :   Size of the rendered frames. Default is 1920 1080.
+    --no-video          :   Do not draw the video layer.
+    --output <file>     :   Write the results to a JSON file.
+"""
+
+# Utility modules
+from ..utils import Load
+from ..utils import *
+from ..utils.SQL import *
+
+from Player import KinectDataPlayer
+from Display import Headless
+
+from os.path import isfile
+from os import remove
+from timeit import default_timer as clock
+from weakref import ref
+
+import numpy as np
+import platform
+import json
+import time
+import sys
+import cv2
+
+try:
+    from resource import getrusage, RUSAGE_SELF
+except ImportError:
+    getrusage = None    # Unix only
+
+class BenchmarkPlayer(KinectDataPlayer):
+    """ Renders every frame without displaying it, counting how many of the
+        player's frame buffers (including the images in its frame cache) are
+        new arrays each frame """
+
+    def __init__(self, performance_id, **kwargs):
+
+        kwargs.setdefault('display', Headless())
+
+        KinectDataPlayer.__init__(self, performance_id, **kwargs)
+
+        self.rendered = 0
+
+        self.allocations = 0
+
+        self._seen = {}     # id -> weak reference of each buffer seen so far
+
+    def update(self):
+
+        arrays = [self._surface, getattr(self, "_videoSurface", None), getattr(self, "_videoFrame", None)]
+
+        for array in arrays + self._cache.values():
+
+            if array is not None:
+
+                seen = self._seen.get(id(array))
+
+                if seen is None or seen() is not array:
+
+                    self._seen[id(array)] = ref(array)
+
+                    self.allocations += 1
+
+        self.rendered += 1
+
+        return
+
+def SyntheticRecording(bodies, frames, video=True):
+    """ Records a synthetic performance and returns its performance id """
+
+    from ..Capture import KinectService, SyntheticSource
+
+    source = SyntheticSource(bodies, frames=frames, video=False)
+
+    service = KinectService(timeout=1, source=source)
+
+    service.listen()
+
+    p_id = service._p_id
+
+    service.close()
+
+    if video:
+
+        # Write the synthetic colour frames as the recording's video
+
+        path = "benchmark_%d.avi" % p_id
+
+        source = SyntheticSource(bodies, frames=frames, video=True)
+
+        writer = cv2.VideoWriter(VIDEO_DIR + path, cv2.VideoWriter_fourcc(*"XVID"), 30.0, source.resolution)
+
+        for frame in range(frames):
+
+            colour = source.color_frame(frame)
+
+            writer.write(cv2.cvtColor(colour.data(), cv2.COLOR_BGRA2BGR))
+
+            colour.release()
+
+        writer.release()
+
+        with Database(DATABASE) as db:
+
+            db.insert(VIDEO_PATH_TABLE, [("performance_id", p_id), ("video_id", 0), ("path", path), ("start_time", 0.0)])
+
+            db.insert_many(VIDEO_TIME_TABLE, [(p_id, frame, source.time_of("color", frame)) for frame in range(frames)])
+
+            db.save()
+
+    return p_id
+
+def DeleteRecording(p_id):
+    """ Removes a synthetic recording and its video """
+
+    path = VIDEO_DIR + "benchmark_%d.avi" % p_id
+
+    DeletePerformance(p_id)
+
+    if isfile(path):
+
+        remove(path)
+
+    return
+
+def run(p_id, reuse, size=(1920, 1080), video=True):
+    """ Plays back a performance and returns a dict of results """
+
+    player = BenchmarkPlayer(p_id, reuse=reuse, size=size, video=video)
+
+    if getrusage is not None:
+        faults = getrusage(RUSAGE_SELF).ru_minflt
+
+    start = clock()
+
+    player.run()
+
+    elapsed = clock() - start
+
+    frames = max(player.rendered, 1)
+
+    if getrusage is not None:
+        faults = float(getrusage(RUSAGE_SELF).ru_minflt - faults) / frames
+    else:
+        faults = None
+
+    return {"reuse": reuse,
+            "size": list(size),
+            "video": video,
+            "frames": player.rendered,
+            "elapsed": elapsed,
+            "frames_per_sec": player.rendered / elapsed,
+            "allocations_per_frame": float(player.allocations) / frames,
+            "page_faults_per_frame": faults}
+
+def main(args):
+
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description="PyKinectTk playback benchmark")
+    parser.add_argument("--performance", type=int, default=None)
+    parser.add_argument("--bodies", type=int, default=2)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--size", type=int, nargs=2, default=[1920, 1080])
+    parser.add_argument("--no-video", dest="video", action="store_false")
+    parser.add_argument("--output", default=None)
+
+    options = parser.parse_args(args)
+
+    p_id = options.performance
+
+    if p_id is None:
+
+        p_id = SyntheticRecording(options.bodies, options.frames, options.video)
+
+    results = []
+
+    try:
+
+        for reuse in (False, True):
+
+            result = run(p_id, reuse, tuple(options.size), options.video)
+
+            results.append(result)
+
+            faults = result["page_faults_per_frame"]
+
+            faults = "%8.1f" % faults if faults is not None else "%8s" % "n/a"
+
+            print "reuse=%-5s %5d frames  %7.1f frames/s  %5.2f new buffers/frame  %s page faults/frame" % (reuse, result["frames"], result["frames_per_sec"],
+                                                                                                       result["allocations_per_frame"], faults)
+
+    finally:
+
+        if options.performance is None:
+
+            DeleteRecording(p_id)
+
+    if options.output is not None:
+
+        with open(options.output, "w") as f:
+
+            json.dump({"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "results": results}, f, indent=2)
+
+    return results
+
+if __name__ == "__main__":
+
+    main(sys.argv[1:])
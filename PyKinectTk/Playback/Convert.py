@@ -5,26 +5,48 @@
 
 # Utility modules
 import sys
+from ..utils import Load
 from ..utils import *
 from ..utils.SQL import *
 
 import Player
 import ProgressBar
+from Display import Headless
 from ..Capture import Writers
 
+from multiprocessing import Process, cpu_count
+from distutils.spawn import find_executable
+from subprocess import call
+from threading import Thread
+from timeit import default_timer as clock
+
+import multiprocessing
+import Queue
+from os.path import splitext, isfile
+from os import remove
+
+import numpy as np
+import cv2
+
 class ConvertKinect(Writers.VideoWriter, Player.KinectDataPlayer):
 
     def __init__(self, performance_id, outputFile=None, **kwargs):
 
+        # Write at full resolution without showing or waiting for a window
+
+        kwargs.setdefault("size", Player.RESOLUTION)
+
+        kwargs.setdefault("display", Headless())
+
+        # Each frame is only rendered once so there is no point caching them
+
+        kwargs.setdefault("cache", 0)
+
         # Inheritance
 
         Player.KinectDataPlayer.__init__(self, performance_id, **kwargs)
         
-        Writers.VideoWriter.__init__(self, VIDEO_DIR + outputFile, self._fps)
-
-        # Set up size
-
-        self._size = self._width, self._height = self._resolution
+        Writers.VideoWriter.__init__(self, VIDEO_DIR + outputFile, self._fps, self._size)
 
         # Progress bar
 
@@ -40,9 +62,464 @@ class ConvertKinect(Writers.VideoWriter, Player.KinectDataPlayer):
         
         self.write(self._surface)
 
-        x = (float(self._current_frame - self._clip_start) / self._clip_length) * 100
-
-        self._progress.update(x)        
+        self._progress.update(self.progress())
         
         return
-        
+
+    def progress(self):
+        """ Returns the percentage of the clip that has been converted """
+        return (float(self._current_frame - self._clip_start) / (self._clip_length - self._clip_start)) * 100
+
+    def close(self):
+        """ Over-rides KinectDataPlayer to also finish writing the file """
+        Player.KinectDataPlayer.close(self)
+        self.release()
+        self._progress.close()
+        return
+
+class PipelinedConvert(ConvertKinect):
+    """ Converts a performance with video decoding, drawing and encoding
+        running at the same time. A decoding thread reads the video into
+        a pool of frame buffers, the calling thread draws the other streams
+        on top and an encoding thread writes them to file. Once written, a
+        buffer goes back to the pool """
+
+    def __init__(self, performance_id, outputFile=None, buffers=8, **kwargs):
+
+        ConvertKinect.__init__(self, performance_id, outputFile, **kwargs)
+
+        # Pool of reusable frame buffers
+
+        self._free = Queue.Queue()
+
+        for i in range(buffers):
+
+            self._free.put(np.zeros((self._height, self._width, 3), np.uint8))
+
+        # Queues between the stages. The pool bounds how many frames each can hold
+
+        self._decoded = Queue.Queue()
+        self._drawn   = Queue.Queue()
+
+        # Stage name -> [frames, seconds spent working]
+
+        self._stages = {"decode": [0, 0.0], "draw": [0, 0.0], "encode": [0, 0.0]}
+
+        self._errors = []
+
+        self._elapsed = 0.0
+
+        self._stopping = False  # Set if drawing stops early, to stop the decoding stage
+
+    def stage(self, name, start):
+        """ Records a frame's worth of work for a stage that began at start """
+        self._stages[name][0] += 1
+        self._stages[name][1] += clock() - start
+        return
+
+    def stats(self):
+        """ Returns a dict of stage -> frames, seconds spent working and frames per second """
+        stats = {}
+        for name, (frames, busy) in self._stages.items():
+            stats[name] = {"frames": frames, "busy": busy, "fps": frames / busy if busy else 0.0}
+        stats["total"] = {"frames": self._stages["encode"][0], "busy": self._elapsed,
+                          "fps": self._stages["encode"][0] / self._elapsed if self._elapsed else 0.0}
+        return stats
+
+    def decode(self):
+        """ Decoding stage: fills a buffer with the video frame for each output frame """
+
+        try:
+
+            video = np.zeros((self._height, self._width, 3), np.uint8)
+
+            playing = -1
+
+            for frame in self.clip():
+
+                buffer = self._free.get()
+
+                if self._stopping:
+
+                    break
+
+                start = clock()
+
+                t = frame / self._fps
+
+                try:
+
+                    if not self._drawing['video'] or t < self.entry_time('video'):
+
+                        raise TimeIndexError
+
+                    n = self.frame_time(t, 'video')
+
+                    if n > playing:
+
+                        self._video.set_frame(n)
+
+                        image = self._video.read()
+
+                        if image.shape[:2] == video.shape[:2]:
+
+                            np.copyto(video, image)
+
+                        else:
+
+                            cv2.resize(image, (self._width, self._height), video)
+
+                        playing = n
+
+                    np.copyto(buffer, video)
+
+                except (TimeIndexError, StopIteration):
+
+                    buffer.fill(0)
+
+                self.stage("decode", start)
+
+                self._decoded.put((frame, buffer))
+
+        except Exception as e:
+
+            self._errors.append(e)
+
+        finally:
+
+            self._decoded.put(None)
+
+        return
+
+    def encode(self):
+        """ Encoding stage: writes each drawn buffer to file and returns it to the pool """
+
+        failed = False
+
+        while True:
+
+            buffer = self._drawn.get()
+
+            if buffer is None:
+
+                break
+
+            if not failed:
+
+                try:
+
+                    start = clock()
+
+                    self.write(buffer)
+
+                    self.stage("encode", start)
+
+                except Exception as e:
+
+                    # Keep emptying the queue so the other stages can finish
+
+                    self._errors.append(e)
+
+                    failed = True
+
+            self._free.put(buffer)
+
+        return
+
+    def run(self, verbose=False):
+
+        start = clock()
+
+        threads = [Thread(target=self.decode), Thread(target=self.encode)]
+
+        for thread in threads:
+
+            thread.daemon = True
+
+            thread.start()
+
+        # Drawing stage
+
+        layers = [stream for stream in self._layers if stream != 'video']
+
+        decoded = False
+
+        try:
+
+            while True:
+
+                item = self._decoded.get()
+
+                if item is None:
+
+                    decoded = True
+
+                    break
+
+                frame, buffer = item
+
+                begin = clock()
+
+                self._current_frame = frame
+
+                self._surface = buffer
+
+                t = frame / self._fps
+
+                for stream in layers:
+
+                    if t >= self.entry_time(stream):
+
+                        try:
+
+                            self.draw[stream](self.frame_time(t, stream))
+
+                        except TimeIndexError as e:
+
+                            if verbose:
+
+                                print "Error in %s stream: %s" % (stream, e)
+
+                self.stage("draw", begin)
+
+                self._drawn.put(buffer)
+
+                self._progress.update(self.progress())
+
+        finally:
+
+            # Always stop both stages and release the file, even if drawing failed
+
+            self._drawn.put(None)
+
+            if not decoded:
+
+                # Hand the decoded buffers back so the decoding stage can see it should stop
+
+                self._stopping = True
+
+                item = self._decoded.get()
+
+                while item is not None:
+
+                    self._free.put(item[1])
+
+                    item = self._decoded.get()
+
+            for thread in threads:
+
+                thread.join()
+
+            self._elapsed = clock() - start
+
+            self.close()
+
+        if self._errors:
+
+            raise self._errors[0]
+
+        if verbose:
+
+            for name, stats in sorted(self.stats().items()):
+
+                print "%-6s %6d frames %8.2fs busy %8.1f frames/s" % (name, stats["frames"], stats["busy"], stats["fps"])
+
+        return
+
+
+def ConvertSegment(performance_id, outputFile, frames, progress, index, kwargs):
+    """ Converts frames (start, end) of a performance to outputFile, reporting progress on a queue """
+
+    converter = ConvertKinect(performance_id, outputFile, frames=frames, progressbar=ProgressBar.QueueBar(progress, index), **kwargs)
+
+    converter.run()
+
+    return
+
+def JoinVideos(paths, output, fps=30.0, size=None):
+    """ Concatenates the video files in paths into output. The streams are
+        copied with ffmpeg if it is installed, otherwise every frame is decoded
+        and re-encoded one segment after another, which takes about as long as
+        rendering them did. size defaults to the size of the first segment """
+
+    ffmpeg = find_executable("ffmpeg")
+
+    if ffmpeg is not None:
+
+        listing = output + ".txt"
+
+        with open(listing, "w") as f:
+
+            for path in paths:
+
+                f.write("file '%s'\n" % path.replace("'", "'\\''"))
+
+        status = call([ffmpeg, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", listing, "-c", "copy", output])
+
+        remove(listing)
+
+        if status == 0:
+
+            return
+
+    if size is None:
+
+        video = cv2.VideoCapture(paths[0])
+
+        size = int(video.get(cv2.CAP_PROP_FRAME_WIDTH)), int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        video.release()
+
+    writer = Writers.VideoWriter(output, fps, size)
+
+    for path in paths:
+
+        video = cv2.VideoCapture(path)
+
+        read, frame = video.read()
+
+        while read:
+
+            writer.write(frame)
+
+            read, frame = video.read(frame)
+
+        video.release()
+
+    writer.release()
+
+    return
+
+class ParallelConvert:
+    """ Converts a performance to an .avi file by splitting the timeframe into
+        segments that are each rendered in their own process and then joined
+        with ffmpeg. Without ffmpeg, joining the segments would cost more than
+        rendering them in parallel saves, so it converts with ConvertKinect """
+
+    def __init__(self, performance_id, outputFile=None, processes=None, **kwargs):
+
+        self._performance_id = performance_id
+
+        self._output = outputFile
+
+        self._processes = processes if processes else cpu_count()
+
+        self._fps = 30.0
+
+        # Progress bar
+
+        self._progress = kwargs.pop("progressbar", None)
+
+        if self._progress is None:
+
+            self._progress = ProgressBar.Console(outputFile)
+
+        # Keyword arguments for each ConvertKinect
+
+        self._timeframe = kwargs.pop('time', (None, None))
+
+        self._kwargs = kwargs
+
+    def segments(self):
+        """ Returns a list of (start, end) frame numbers for each process to render """
+
+        streams = [stream for stream in ("body", "video") if self._kwargs.get(stream, True)]
+
+        duration = Load.Duration(self._performance_id, streams)
+
+        start, end = self._timeframe
+
+        first = 0 if start is None else int(start * self._fps)
+
+        last  = int((duration if end is None else min(end, duration)) * self._fps)
+
+        bounds = np.linspace(first, last, self._processes + 1).astype(int)
+
+        return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+    def run(self):
+
+        if find_executable("ffmpeg") is None:
+
+            return self.run_serial()
+
+        segments = self.segments()
+
+        name, ext = splitext(self._output)
+
+        files = ["%s.part%02d%s" % (name, i, ext) for i in range(len(segments))]
+
+        # Start a process for each segment
+
+        progress = multiprocessing.Queue()
+
+        processes = [Process(target=ConvertSegment, args=(self._performance_id, files[i], segments[i], progress, i, self._kwargs)) for i in range(len(segments))]
+
+        for process in processes:
+
+            process.start()
+
+        # Show the progress of all the segments, weighted by their length
+
+        done = [0.0] * len(segments)
+
+        weight = np.array([end - start for start, end in segments], float) / max(sum(end - start for start, end in segments), 1)
+
+        while any(process.is_alive() for process in processes):
+
+            try:
+
+                index, x = progress.get(timeout=0.1)
+
+                done[index] = x
+
+            except Queue.Empty:
+
+                pass
+
+            for i, process in enumerate(processes):
+
+                if not process.is_alive():
+
+                    done[i] = 100.0
+
+            self._progress.update(float(np.dot(weight, done)))
+
+        for process in processes:
+
+            process.join()
+
+        failed = [i for i, process in enumerate(processes) if process.exitcode != 0]
+
+        # Join the segments into the output file
+
+        paths = [VIDEO_DIR + f for f in files]
+
+        if not failed:
+
+            JoinVideos(paths, VIDEO_DIR + self._output, self._fps, self._kwargs.get("size", Player.RESOLUTION))
+
+        for path in paths:
+
+            if isfile(path):
+
+                remove(path)
+
+        if failed:
+
+            raise RuntimeError("Converting segment(s) %s of '%s' failed" % (failed, self._output))
+
+        self._progress.update(100.0)
+
+        self._progress.close()
+
+        return
+
+    def run_serial(self):
+        """ Converts the whole timeframe in this process """
+
+        converter = ConvertKinect(self._performance_id, self._output, progressbar=self._progress, time=self._timeframe, **self._kwargs)
+
+        converter.run()
+
+        return
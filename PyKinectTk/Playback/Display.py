@@ -0,0 +1,96 @@
+"""
+    Where KinectDataPlayer sends the frames it renders. The default is
+    an OpenCV window; the others make no HighGUI calls and only wait when
+    playing in real time, so rendering runs at full speed on machines
+    without a display.
+
+"""
+
+from time import sleep
+
+import numpy as np
+import cv2
+
+class Headless:
+    """ Discards the rendered frames. Sub-classes over-ride show() """
+
+    #: Last key pressed, or -1
+    key = -1
+
+    def start(self, frames, size):
+        """ Called before playback with the number of frames and their size (width, height) """
+        return
+
+    def show(self, frame, image):
+        """ Called with the frame number and image of each rendered frame """
+        return
+
+    def quitting(self, wait=None):
+        """ Waits wait seconds (if given) and returns True if playback should stop """
+        if wait is not None and wait > 0:
+            sleep(wait)
+        return False
+
+    def close(self):
+        return
+
+class WindowDisplay(Headless):
+    """ Shows the frames in an OpenCV window, waiting wait ms for a key
+        press between frames. Pressing 'q' stops playback and the other
+        keys are handled by KinectDataPlayer.control() """
+
+    def __init__(self, title='PyKinectTk Playback', wait=20):
+        self.title = title
+        self.wait  = wait
+
+    def show(self, frame, image):
+        cv2.imshow(self.title, image)
+        return
+
+    def quitting(self, wait=None):
+        wait = self.wait if wait is None else max(1, int(wait * 1000))
+        key = cv2.waitKey(wait)
+        self.key = -1 if key == -1 else key & 0xFF
+        return self.key == ord('q')
+
+    def close(self):
+        cv2.destroyAllWindows()
+        return
+
+class CallbackDisplay(Headless):
+    """ Calls callback(frame, image) for each frame. The image is re-used
+        for the next frame unless copy is True """
+
+    def __init__(self, callback, copy=False):
+        self.callback = callback
+        self.copy = copy
+
+    def show(self, frame, image):
+        self.callback(frame, image.copy() if self.copy else image)
+        return
+
+class StackDisplay(Headless):
+    """ Keeps every nth frame in a NumPy array of shape (frames, height, width, 3),
+        allocated when playback starts """
+
+    def __init__(self, every=1):
+        self.every  = every
+        self.images = None
+        self.frames = []
+
+    def start(self, frames, size):
+        self.images = np.zeros(((frames + self.every - 1) // self.every, size[1], size[0], 3), np.uint8)
+        self.frames = []
+        self._count = 0
+        return
+
+    def show(self, frame, image):
+        if self._count % self.every == 0 and len(self.frames) < len(self.images):
+            np.copyto(self.images[len(self.frames)], image)
+            self.frames.append(frame)
+        self._count += 1
+        return
+
+    def array(self):
+        """ Returns the stack of images kept so far """
+        return self.images[:len(self.frames)]
@@ -0,0 +1,99 @@
+"""
+    Draws skeletons over a frame. The co-ordinates of every joint of every
+    body at a frame are scaled in one go and each colour's bones are drawn
+    with a single call to cv2.polylines. Joints without a finite pixel
+    co-ordinate, or that are not tracked, are left out.
+
+"""
+
+from ..utils.Skeleton import JointTypes, TrackStates
+
+import numpy as np
+import cv2
+
+HEAD = JointTypes.index("Head")
+
+#: Pixel co-ords are clipped to this so they fit in the int32 OpenCV expects
+LIMIT = 1 << 20
+
+class SkeletonOverlay:
+
+    def __init__(self, size, resolution=(1920, 1080), width=2, head_size=None, min_state=TrackStates['Inferred']._id):
+
+        # Scale from the resolution of the pixel co-ords to the size of the frame
+
+        self.scale = np.array(size, float) / np.array(resolution, float)
+
+        self.width = width
+
+        self.head_size = sum(size) / 200 if head_size is None else head_size
+
+        # Joints with a lower tracking state than this are not drawn
+
+        self.min_state = min_state
+
+        self.parents  = JointTypes.bone_parents
+        self.children = JointTypes.bone_children
+
+    def points(self, pixels, tracking=None):
+        """ Takes pixel co-ords (..., 25, 2) and returns them as int32 co-ords
+            in the frame and a mask (..., 25) of the joints to draw """
+
+        pixels = np.asarray(pixels)
+
+        valid = np.isfinite(pixels).all(axis=-1)
+
+        if tracking is not None:
+
+            valid &= np.asarray(tracking) >= self.min_state
+
+        points = np.where(valid[..., None], pixels * self.scale, 0)
+
+        return np.clip(points, -LIMIT, LIMIT).astype(np.int32), valid
+
+    def draw(self, surface, pixels, colours, tracking=None, present=None):
+        """ Draws the skeletons of bodies onto surface. pixels is (bodies, 25, 2),
+            colours has one colour per body, tracking is an optional (bodies, 25)
+            array of tracking states and present an optional (bodies,) mask of the
+            bodies to draw """
+
+        points, valid = self.points(pixels, tracking)
+
+        if present is not None:
+
+            valid &= np.asarray(present, bool)[:, None]
+
+        # Bones with both ends drawn, as (bodies, bones, 2 ends, x/y)
+
+        drawn = valid[:, self.parents] & valid[:, self.children]
+
+        bones = np.stack((points[:, self.parents], points[:, self.children]), axis=2)
+
+        # Gather the bones of each colour
+
+        lines = {}
+
+        for b, colour in enumerate(colours[:len(points)]):
+
+            lines.setdefault(tuple(colour), []).append(bones[b][drawn[b]])
+
+        for colour, segments in lines.items():
+
+            segments = np.concatenate(segments)
+
+            if len(segments):
+
+                cv2.polylines(surface, segments, False, colour, self.width)
+
+        # Heads
+
+        for b in np.flatnonzero(valid[:, HEAD]):
+
+            cv2.circle(surface, tuple(points[b, HEAD].tolist()), self.head_size, tuple(colours[b]), -1)
+
+        return
+
+    def draw_body(self, surface, pixels, colour, tracking=None):
+        """ Draws one skeleton, with pixels (25, 2) and optional tracking states (25,) """
+        self.draw(surface, np.asarray(pixels)[None], [colour], None if tracking is None else np.asarray(tracking)[None])
+        return
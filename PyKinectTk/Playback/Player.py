@@ -9,6 +9,8 @@
 
 # Playback modules
 from Readers import *
+from Overlay import SkeletonOverlay, HEAD
+from Display import *
 
 # Utility modules
 from ..utils import Load
@@ -19,6 +21,68 @@ from ..utils.SQL import *
 import numpy as np
 import cv2
 
+from timeit import default_timer as clock
+from collections import OrderedDict
+
+
+#: Resolution of the Kinect colour camera, which pixel co-ords are given in
+RESOLUTION = 1920, 1080
+
+class PlaybackClock:
+    """ Counts the frames (ticks) that should have been shown since start(),
+        starting from a given tick and playing at a given rate """
+
+    def __init__(self, fps):
+        self.fps = fps
+        self.start()
+
+    def start(self, tick=0, rate=1.0):
+        self._start = clock()
+        self._tick  = tick
+        self._rate  = rate
+        return
+
+    def time(self):
+        """ Returns the seconds since start() """
+        return clock() - self._start
+
+    def tick(self):
+        """ Returns the index of the frame due now """
+        return self._tick + int(self.time() * self.fps * self._rate)
+
+    def until(self, tick):
+        """ Returns the seconds until a frame is due (negative if it is late) """
+        return (tick - self._tick) / (self.fps * self._rate) - self.time()
+
+class Timeline:
+    """ Index of the frame of each stream (-1 if none) at every tick of the
+        output, built once from the streams' FrameTime objects """
+
+    def __init__(self, streams, fps, ticks):
+
+        self.fps = fps
+
+        self.ticks = ticks
+
+        times = np.arange(ticks) / fps
+
+        self.index = dict((stream, frames.frame_at_times(times).astype(np.int32)) for stream, frames in streams.items())
+
+    def __len__(self):
+        return self.ticks
+
+    def tick(self, t):
+        """ Returns the tick nearest time t """
+        return int(round(t * self.fps))
+
+    def frame(self, stream, tick):
+        """ Returns the frame of stream at tick, or -1 if there is none """
+        index = self.index[stream]
+        return int(index[tick]) if 0 <= tick < len(index) else -1
+
+    def frames(self, tick):
+        """ Returns a dict of stream -> frame at tick """
+        return dict((stream, self.frame(stream, tick)) for stream in self.index)
 
 class KinectDataPlayer:
 
@@ -40,6 +104,31 @@ class KinectDataPlayer:
         self._fps = 30.0
         self._wait = 20
 
+        #: Play in time with a clock, dropping frames that cannot be drawn in time
+
+        self._realtime = bool(kwargs.get('realtime', False))
+
+        self._clock = PlaybackClock(self._fps)
+
+        self._stats = {'rendered': 0, 'dropped': 0, 'late': 0, 'max_lag': 0.0, 'cache_hits': 0, 'cache_misses': 0}
+
+        #: Playback controls - see seek(), step(), pause(), resume() and set_rate()
+
+        self._paused = False
+
+        self._rate = 1.0
+
+        self._dirty = False     # Set when the controls move playback somewhere new
+
+        self._scrubbing = False # Set by seek() and step() until playback moves on by itself
+
+        #: Frames rendered while paused or scrubbing, tick -> image, least recently used first.
+        #: Frames played through in order are not kept so normal playback makes no copies
+
+        self._cache = OrderedDict()
+
+        self._cache_size = int(kwargs.get('cache', 30))
+
         #: Define the timeframe to draw
 
         self._timeframe = kwargs.get('time',(None, None))
@@ -53,13 +142,33 @@ class KinectDataPlayer:
         #: Dictionary of stream name -> dictionary of frame numbers and timestamps
         self._frames = {}
 
+        #: Size of the output
+
+        self._resolution = RESOLUTION
+
+        self._size = self._width, self._height = kwargs.get('size', (960, 540))
+
+        #: Render into buffers allocated once instead of new arrays each frame
+
+        self._reuse = bool(kwargs.get('reuse', True))
+
         #######################--- SETUP STREAMS ---#######################
 
         # Video data
 
         if self._drawing['video']:
 
-            self._video = VideoReader(performance_id)
+            # Decode ahead on a background thread if prefetch is a number of frames
+
+            prefetch = kwargs.get('prefetch', False)
+
+            if prefetch:
+
+                self._video = PrefetchVideoReader(performance_id, int(prefetch), self._size)
+
+            else:
+
+                self._video = VideoReader(performance_id)
 
             VideoFrameTime = Load.VideoData(performance_id)
 
@@ -69,7 +178,9 @@ class KinectDataPlayer:
 
             self.draw['video'] = self.draw_video
 
-            self._videoSurface = None
+            self._videoSurface = np.zeros((self._height, self._width, 3), np.uint8)
+
+            self._videoFrame = None # Decoded frame before resizing
 
             self._wait = 1
 
@@ -77,7 +188,9 @@ class KinectDataPlayer:
 
         if self._drawing['body']:
 
-            self._bodies = Load.BodyData(performance_id)
+            self._body_arrays = Load.BodyArrays(performance_id)
+
+            self._bodies = self._body_arrays.bodies()
 
             self._key_joints = ["HandTipLeft",
                                 "HandTipRight",
@@ -119,25 +232,51 @@ class KinectDataPlayer:
 
         #######################--- SETUP DISPLAY ---#######################
 
-        self._resolution = 1920, 1080
+        #: Where rendered frames go - an OpenCV window unless another Display is given
 
-        self._size = self._width, self._height = 960, 540
+        self._display = kwargs.get('display', None)
 
-        self._surface = None
+        if self._display is None:
+
+            self._display = WindowDisplay(wait=self._wait)
+
+        self._surface = np.zeros((self._height, self._width, 3), np.uint8)
 
         self._head_size = sum(self._size) / 200
 
+        self._overlay = SkeletonOverlay(self._size, self._resolution, head_size=self._head_size)
+
         self._largest_clip = max(self._frames.values(), key=lambda x: x.max_time() ).max_time()
 
         self._clip_start  = 0 if self._timeframe[0] is None else int(self._timeframe[0] * self._fps)
 
         self._clip_length = int((self._largest_clip if self._timeframe[1] is None else self._timeframe[1]) * self._fps)
 
+        #: A range of frame numbers can be given instead of a timeframe
+
+        if kwargs.get('frames') is not None:
+
+            self._clip_start, self._clip_length = kwargs['frames']
+
+        #: Frame of each stream at every tick of the output
+
+        streams = dict((stream, self._frames[stream]) for stream in self._frames if stream != 'info')
+
+        self._timeline = Timeline(streams, self._fps, max(self._clip_length, int(np.ceil(self._largest_clip * self._fps))))
+
+        #: Ticks of the first and last + 1 frames of the clip, and the tick being played
+
+        clip = self.clip()
+
+        self._first, self._end = (clip[0], clip[-1] + 1) if clip else (self._clip_start, self._clip_start)
+
+        self._position = self._first
+
     #: General utility methods
 
     def update(self):
         """ Writes new frame to screen/file """
-        cv2.imshow('PyKinectTk Playback', self._surface)
+        self._display.show(self._current_frame, self._surface)
         return
 
     def layers_to_draw(self):
@@ -148,11 +287,18 @@ class KinectDataPlayer:
                 del layers[layers.index(stream)]
         return layers
 
-    def draw_new_frame(self):
-        """ Clears the next frame to display """
-        self._surface = np.zeros((self._height, self._width, 3), np.uint8)
+    def draw_new_frame(self, t=None):
+        """ Clears the next frame to display, unless a video frame will cover it at time t """
+        if not self._reuse:
+            self._surface = np.zeros((self._height, self._width, 3), np.uint8)
+        elif t is None or not self.video_at(t):
+            self._surface.fill(0)
         return
 
+    def video_at(self, t):
+        """ Returns True if a frame of video is drawn at time t """
+        return self._drawing['video'] and self._timeline.frame('video', self._timeline.tick(t)) >= 0
+
     def ratio(self):
         """ Returns the the % of change in size of frame """
         return float(self._size[0]) / self._resolution[0]
@@ -164,30 +310,39 @@ class KinectDataPlayer:
     def frame_time(self, t, stream):
         """ Returns the frame number for data stream that occurs at time t """
         if stream is not "info":
-            return self._frames[stream].frame_at_time(t)
+            frame = self._timeline.frame(stream, self._timeline.tick(t))
+            if frame < 0:
+                raise TimeIndexError("No %s frame found at time '%s'" % (stream, t))
+            return frame
         else:
             return t
 
     def entry_time(self, stream):
         """ Returns the timestamp of the first occurence of data of the given stream """
-        return min(self._frames[stream].timestamps())
+        return self._frames[stream].min_time()
 
     #: Drawing skeleton methods
 
     def draw_bodies(self, n):
         """ Draws the body data at frame n """
 
-        for i, body in enumerate(self._bodies):
+        data = self._body_arrays
+
+        if not 0 <= n < len(data):
 
-            if body.hasData(n):
+            return
 
-                # Draw the body
+        # Draw every skeleton at once
 
-                self.draw_skeleton(body, n, COLOUR[i])
+        self._overlay.draw(self._surface, data.pixels[n], COLOUR, data.tracking[n], data.mask[n])
+
+        for i, body in enumerate(self._bodies):
+
+            if data.mask[n, i]:
 
                 # Label the body with appropriate value 0-5
 
-                self.draw_label(str(body), body['Head'].pixel(n), COLOUR[i], offset=[25]*2, size=2)
+                self.draw_label(str(body), data.pixels[n, i, HEAD], COLOUR[i], offset=[25]*2, size=2)
 
                 # Draw X, Y, Z data for certain joints
 
@@ -200,23 +355,7 @@ class KinectDataPlayer:
 
     def draw_skeleton(self, skeleton, time, colour):
 
-        for joint in skeleton:
-
-            if joint == "Head":
-
-                # Draw a circle
-
-                self.draw_head(joint.pixel(time), colour)
-
-            else:
-
-                # Draw any bones from the joint
-
-                lines = joint.bones(time)
-
-                for start, end in lines:
-
-                    self.draw_bone(start, end, colour)
+        self._overlay.draw_body(self._surface, skeleton.pixels(time), colour, [joint.tracking(time) for joint in skeleton])
                             
                         
     def draw_bone(self, xy1, xy2, colour, width=2):
@@ -237,21 +376,66 @@ class KinectDataPlayer:
     #: Drawing video methods
 
     def draw_video(self, n):
-        """ Reads the next frame of video """
+        """ Reads the next frame of video. Raises TimeIndexError, leaving the
+            frame black, if the video file ends before frame n """
 
-        if n > self._frame_playing['video']:
+        if n != self._frame_playing['video']:
 
             self._video.set_frame(n)
 
-            self._videoSurface = self._video.read()
+            try:
+
+                self.read_video()
+
+            except StopIteration:
+
+                # The file is shorter than its time table. StopIteration would
+                # silently end frames() so it is raised as a missing frame
+
+                self._frame_playing['video'] = -1
+
+                self.draw_new_frame()
 
-            self._videoSurface = cv2.resize(self._videoSurface, (self._width, self._height))
+                raise TimeIndexError("No video frame %d in the file" % n)
 
             self._frame_playing['video'] = n
 
         # Draw onto self._screen
+
+        if self._reuse:
+
+            np.copyto(self._surface, self._videoSurface)
+
+        else:
         
-        self._surface = np.copy(self._videoSurface)
+            self._surface = np.copy(self._videoSurface)
+
+        return
+
+    def read_video(self):
+        """ Decodes the next frame of video into self._videoSurface, resized to the output """
+
+        if self._reuse:
+
+            # Decode and resize into the same buffers each time
+
+            self._videoFrame = self._video.read(self._videoFrame)
+
+            if self._videoFrame.shape[:2] != (self._height, self._width):
+
+                cv2.resize(self._videoFrame, (self._width, self._height), self._videoSurface)
+
+            else:
+
+                np.copyto(self._videoSurface, self._videoFrame)
+
+        else:
+
+            self._videoSurface = self._video.read()
+
+            if self._videoSurface.shape[:2] != (self._height, self._width):
+
+                self._videoSurface = cv2.resize(self._videoSurface, (self._width, self._height))
 
         return
 
@@ -279,8 +463,14 @@ class KinectDataPlayer:
                     pass
         return
     
-    def quitting(self):
-        return cv2.waitKey(self._wait) & 0xFF == ord('q')
+    def quitting(self, wait=None):
+        quitting = self._display.quitting(wait)
+        self.control(self._display.key)
+        return quitting
+
+    def clip(self):
+        """ Returns the frame numbers of the clip being played """
+        return [frame for frame in xrange(self._clip_start, self._clip_length) if frame / self._fps < self._largest_clip]
 
     def run(self, verbose=False):
         
@@ -289,49 +479,249 @@ class KinectDataPlayer:
             The program loops at 30fps and then uses the timestamp for each stream
             to decide whether or not to render the next frame
         """
+
+        for frame, image in self.frames(verbose):
+
+            # Update the screen
+                
+            self.update()
+
+        # Exit cleanly
         
-        for frame in xrange(self._clip_start, self._clip_length):
+        self.close()
+
+    def frames(self, verbose=False):
+        """ Renders the clip, yielding the frame number and image of each frame.
+            The image is drawn over by the next frame, so copy it to keep it.
+
+            In real time mode, frames are shown when the clock reaches them and
+            frames whose time has already passed are dropped without being drawn.
+            While paused, the frame is only rendered again when it changes """
+
+        self._display.start(self._end - self._first, self._size)
+
+        self._dirty = True
+
+        while self._first <= self._position < self._end:
+
+            if self._paused:
+
+                if self.quitting(1 / self._fps):
+
+                    break
+
+                if self._dirty:
+
+                    self._dirty = False
+
+                    yield self._position, self.current(verbose)
+
+                continue
+
+            if self._dirty:
 
-            self._current_frame = frame
+                # Playback has started, resumed or moved so restart the clock
 
-            t = frame / self._fps
+                self._dirty = False
 
-            # Check for exits
+                self._clock.start(self._position, self._rate)
 
-            if self.quitting() or t >= self._largest_clip:
+            wait = None
+
+            if self._realtime:
+
+                # Skip any frames that are already late
+
+                due = self._clock.tick()
+
+                if due > self._position:
+
+                    self._stats['dropped'] += min(due, self._end) - self._position
+
+                    self._position = due
+
+                    if self._position >= self._end:
+
+                        break
+
+                wait = self._clock.until(self._position)
+
+            # Check for exits, waiting until the frame is due in real time mode
+
+            if self.quitting(wait):
 
                 break
 
-            # Start by clearing the frame
+            if self._dirty or self._paused:
 
-            self.draw_new_frame()
+                continue
 
-            # Iterate over in order of layers and draw streams
+            frame = self._position
 
-            for stream in self._layers:
+            self.current(verbose)
 
-                if t >= self.entry_time(stream):
+            self._stats['rendered'] += 1
 
-                    try:
+            if self._realtime:
 
-                        self.draw[stream](self.frame_time(t, stream))
+                lag = -self._clock.until(frame)
 
-                    except TimeIndexError as e:
+                self._stats['max_lag'] = max(self._stats['max_lag'], lag)
 
-                        if verbose:
+                if lag > 1 / self._fps:
 
-                            print "Error in %s stream: %s" % (stream, e)
+                    self._stats['late'] += 1
 
-            # Update the screen
-                
-            self.update()
+            yield frame, self._surface
 
-        # Exit cleanly
-        
-        self.close()
+            if not self._dirty:
+
+                self._position += 1
+
+                self._scrubbing = False
+
+    #: Playback controls
+
+    def seek(self, t):
+        """ Moves playback to time t (seconds) """
+        return self.seek_tick(self._timeline.tick(t))
+
+    def seek_tick(self, tick):
+        """ Moves playback to a tick of the output, kept within the clip """
+        self._position = int(min(max(tick, self._first), self._end - 1))
+        self._dirty = True
+        self._scrubbing = True
+        return
+
+    def step(self, n=1):
+        """ Moves playback n frames forwards (or backwards if negative) """
+        return self.seek_tick(self._position + n)
+
+    def pause(self):
+        self._paused = True
+        self._dirty = True
+        return
+
+    def resume(self):
+        self._paused = False
+        self._dirty = True
+        return
+
+    def set_rate(self, rate):
+        """ Sets the speed of real time playback, 1.0 being normal speed """
+        self._rate = float(rate)
+        self._dirty = True
+        return
+
+    def position(self):
+        """ Returns the time (seconds) of the frame being played """
+        return self._position / self._fps
+
+    def control(self, key):
+        """ Handles a key press: space pauses/resumes, a/d steps back/forward
+            a frame, j/l seeks back/forward 5 seconds and [/] halves/doubles the rate """
+        if key == ord(' '):
+            self.resume() if self._paused else self.pause()
+        elif key == ord('a'):
+            self.step(-1)
+        elif key == ord('d'):
+            self.step(1)
+        elif key == ord('j'):
+            self.seek(self.position() - 5)
+        elif key == ord('l'):
+            self.seek(self.position() + 5)
+        elif key == ord('['):
+            self.set_rate(self._rate / 2)
+        elif key == ord(']'):
+            self.set_rate(self._rate * 2)
+        return
+
+    def current(self, verbose=False):
+        """ Draws the frame at the current position, re-using it from the cache
+            if it was rendered recently while paused or scrubbing, and returns the image """
+
+        tick = self._position
+
+        self._current_frame = tick
+
+        image = self._cache.pop(tick, None)
+
+        if image is not None:
+
+            np.copyto(self._surface, image)
+
+            self._stats['cache_hits'] += 1
+
+        else:
+
+            self.render(tick, verbose)
+
+            self._stats['cache_misses'] += 1
+
+            if self._cache_size <= 0 or not (self._paused or self._scrubbing):
+
+                return self._surface
+
+            # Re-use the least recently used image's buffer once the cache is full
+
+            if len(self._cache) >= self._cache_size:
+
+                image = self._cache.popitem(last=False)[1]
+
+                np.copyto(image, self._surface)
+
+            else:
+
+                image = self._surface.copy()
+
+        self._cache[tick] = image
+
+        return self._surface
+
+    def render(self, tick, verbose=False):
+        """ Draws every layer at a tick of the output onto the surface """
+
+        t = tick / self._fps
+
+        # Start by clearing the frame
+
+        self.draw_new_frame(t)
+
+        # Iterate over in order of layers and draw streams
+
+        for stream in self._layers:
+
+            if stream == 'info':
+
+                self.draw[stream](t)
+
+                continue
+
+            frame = self._timeline.frame(stream, tick)
+
+            try:
+
+                if frame < 0:
+
+                    raise TimeIndexError("No frame found at time '%s'" % t)
+
+                self.draw[stream](frame)
+
+            except TimeIndexError as e:
+
+                if verbose:
+
+                    print "Error in %s stream: %s" % (stream, e)
+
+        return
+
+    def playback_stats(self):
+        """ Returns a dict of the number of frames rendered, dropped for being
+            late and shown more than a frame late, and the largest lag (seconds) """
+        return dict(self._stats)
 
     def close(self):
         """ Closes and open modules / files etc """
         if self._drawing['video']:
             self._video.close()
-        cv2.destroyAllWindows()
+        self._display.close()
@@ -19,6 +19,9 @@ class ProgressBar:
     def draw(self):
         return
 
+    def close(self):
+        return
+
 class GraphicalBar(ProgressBar):
     def __init__(self, length=250, height=40):
         ProgressBar.__init__(self, length)
@@ -29,7 +32,11 @@ class GraphicalBar(ProgressBar):
         cv2.rectangle(window, (0,0), (a,self.h), (0,255,20), -1)
         cv2.putText(window, "%.2f%%" % self.x, (self.l - 50, self.h / 2), cv2.FONT_HERSHEY_PLAIN, 1, (255,255,255), 1, cv2.LINE_AA)
         cv2.imshow('Converting...', window)
+        cv2.waitKey(1)
         return        
+    def close(self):
+        cv2.destroyWindow('Converting...')
+        return
     
 
 class Console(ProgressBar):
@@ -42,3 +49,18 @@ class Console(ProgressBar):
         sys.stdout.write("\r" + out)
         sys.stdout.flush()
         return
+
+
+class QueueBar(ProgressBar):
+    """ Reports progress from another process by putting (index, percentage) on a queue """
+    def __init__(self, queue, index, step=1.0):
+        ProgressBar.__init__(self, 0)
+        self.queue = queue
+        self.index = index
+        self.step  = step
+        self.sent  = None
+    def draw(self):
+        if self.sent is None or self.x - self.sent >= self.step:
+            self.queue.put((self.index, self.x))
+            self.sent = self.x
+        return
@@ -1,22 +1,52 @@
 from ..utils import *
 from ..utils.SQL import *
 from cv2 import VideoCapture
+from threading import Thread, Lock, Event
+from Queue import Queue, Empty
+
+import numpy as np
+import cv2
+
+#: VideoCapture property ids
+POS_FRAMES   = 1    # Index of the next frame to be decoded
+FRAME_WIDTH  = 3
+FRAME_HEIGHT = 4
 
 class VideoReader:
+    """ Reads the frames of a recording's video. The reader keeps track of its
+        position so moving to a frame shortly ahead decodes forward to it
+        instead of seeking, which on XVID means a keyframe seek and re-decode """
 
-    def __init__(self,  p_id):
+    def __init__(self,  p_id, max_skip=30):
 
         with Database(DATABASE) as db:
             path = VIDEO_DIR + db.get('path','tbl_VideoPath','performance_id',p_id)
 
         self.data = VideoCapture(path)
 
-    def read(self):
+        # Index of the frame the next read() returns
+
+        self.position = 0
+
+        # Furthest ahead a frame can be before seeking is quicker than decoding to it
 
-        read, contents = self.data.read()
+        self.max_skip = max_skip
+
+        self.seeks   = 0    # Number of times set_frame seeked
+        self.decodes = 0    # Number of frames decoded by read()
+        self.grabs   = 0    # Number of frames skipped by set_frame without seeking
+
+    def read(self, image=None):
+        """ Returns the next frame, decoding into image if it is an array of the right size """
+
+        read, contents = self.data.read(image)
 
         if read:
 
+            self.position += 1
+
+            self.decodes += 1
+
             return contents
 
         else:
@@ -25,10 +55,34 @@ class VideoReader:
 
     def set_frame(self, frame):
 
-        self.data.set(1, frame)
+        if frame == self.position:
+
+            return
+
+        if self.position < frame <= self.position + self.max_skip:
+
+            # Decode forward to the frame without converting the skipped frames
+
+            while self.position < frame and self.data.grab():
+
+                self.position += 1
+
+                self.grabs += 1
+
+        else:
+
+            self.data.set(POS_FRAMES, frame)
+
+            self.position = frame
+
+            self.seeks += 1
 
         return
 
+    def stats(self):
+        """ Returns a dict of how many seeks, decodes and skipped frames there have been """
+        return {"seeks": self.seeks, "decodes": self.decodes, "grabs": self.grabs}
+
     def close(self):
 
         self.data.release()
@@ -36,3 +90,218 @@ class VideoReader:
         return
         
         
+
+class PrefetchVideoReader(Thread, VideoReader):
+    """ A VideoReader that decodes ahead on a background thread into a ring of
+        preallocated buffers, optionally resized to size (width, height). The
+        array returned by read() is only valid until the next call to read() """
+
+    def __init__(self, p_id, frames=8, size=None, max_skip=30):
+
+        Thread.__init__(self)
+        VideoReader.__init__(self, p_id, max_skip)
+
+        self.daemon = True
+
+        native = int(self.data.get(FRAME_WIDTH)), int(self.data.get(FRAME_HEIGHT))
+
+        self.size = native if size is None else tuple(size)
+
+        self._resize = self.size != native
+
+        # Ring of preallocated frame buffers: K - 1 being filled, one held by the reader
+
+        self.buffers = np.zeros((frames, self.size[1], self.size[0], 3), np.uint8)
+
+        self._decoded = None    # Reused buffer for frames that need resizing
+
+        self._free  = Queue()
+        self._ready = Queue()
+
+        for i in range(frames):
+
+            self._free.put(i)
+
+        self._held = None       # Index of the buffer last returned by read()
+
+        # Seeks are carried out by the decoding thread. Each seek starts a new
+        # generation and frames decoded for older generations are thrown away
+
+        self._lock = Lock()
+        self._wake = Event()
+
+        self.generation = 0
+        self._seek_to   = None
+        self._decoding  = 0     # Index of the next frame the thread decodes
+
+        self.stalls = 0         # Number of reads that had to wait for a frame
+
+        self.running = True
+
+        self.start()
+
+    def run(self):
+
+        while self.running:
+
+            try:
+
+                i = self._free.get(timeout=0.1)
+
+            except Empty:
+
+                continue
+
+            with self._lock:
+
+                if self._seek_to is not None:
+
+                    self.data.set(POS_FRAMES, self._seek_to)
+
+                    self._decoding = self._seek_to
+
+                    self._seek_to = None
+
+                    self._wake.clear()
+
+                generation, frame = self.generation, self._decoding
+
+            if self.decode(self.buffers[i]):
+
+                self._decoding += 1
+
+                self.decodes += 1
+
+                self._ready.put((generation, frame, i))
+
+            else:
+
+                # End of the video: wait until there is a seek or the reader closes
+
+                self._free.put(i)
+
+                self._ready.put((generation, frame, None))
+
+                self._wake.wait()
+
+                self._wake.clear()
+
+        return
+
+    def decode(self, buffer):
+        """ Decodes the next frame into buffer and returns True if there was one """
+
+        if self._resize:
+
+            read, self._decoded = self.data.read(self._decoded)
+
+            if read:
+
+                cv2.resize(self._decoded, self.size, buffer)
+
+            return read
+
+        read, image = self.data.read(buffer)
+
+        if read and image is not buffer:
+
+            np.copyto(buffer, image)
+
+        return read
+
+    def read(self, image=None):
+        """ Returns the next decoded frame. image is ignored as frames are decoded into the ring """
+
+        # Release the previous frame back to the decoding thread
+
+        if self._held is not None:
+
+            self._free.put(self._held)
+
+            self._held = None
+
+        while True:
+
+            if self._ready.empty():
+
+                self.stalls += 1
+
+            generation, frame, i = self._ready.get()
+
+            if generation != self.generation:
+
+                if i is not None:
+
+                    self._free.put(i)
+
+                continue
+
+            if i is None:
+
+                # Leave the end marker for any further reads
+
+                self._ready.put((generation, frame, None))
+
+                raise StopIteration
+
+            self.position = frame + 1
+
+            self._held = i
+
+            return self.buffers[i]
+
+    def set_frame(self, frame):
+
+        if frame == self.position:
+
+            return
+
+        if self.position < frame <= self.position + self.max_skip:
+
+            # Skip over frames that have already been (or are being) decoded
+
+            try:
+
+                while self.position < frame:
+
+                    self.read()
+
+                    self.grabs += 1
+
+            except StopIteration:
+
+                pass
+
+        else:
+
+            with self._lock:
+
+                self.generation += 1
+
+                self._seek_to = frame
+
+            self.position = frame
+
+            self.seeks += 1
+
+            self._wake.set()
+
+        return
+
+    def stats(self):
+        """ Returns a dict of how many seeks, decodes, skipped frames and stalled reads there have been """
+        stats = VideoReader.stats(self)
+        stats["stalls"] = self.stalls
+        return stats
+
+    def close(self):
+
+        self.running = False
+
+        self._wake.set()
+
+        self.join()
+
+        VideoReader.close(self)
+
+        return
@@ -2,3 +2,5 @@ from Convert import *
 from Player  import *
 from Select  import *
 from Readers import *
+from Overlay import *
+from Display import *
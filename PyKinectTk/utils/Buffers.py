@@ -0,0 +1,213 @@
+"""
+    Buffers.py
+
+    Preallocated frame buffers that can be handed from the thread that
+    fills them to the threads that use them without copying, and rings
+    that keep the frames of a stream until they are read. Only needs
+    NumPy so it works with any frame source, not just the Kinect runtime.
+
+    Usage:
+
+        pool  = FramePool((1080, 1920, 4), np.uint8)
+
+        frame = pool.acquire()          # Holder count is 1
+        fill(frame.array)
+
+        consumer(frame.retain())        # Consumer calls frame.release() when done
+        frame.release()                 # Buffer goes back to the pool at 0
+
+        ring = FrameRing(8)
+
+        ring.publish(frame)             # Producer thread
+        for seq, frame in ring.drain(): # Consumer thread, every frame since the last drain
+            ...
+
+"""
+
+from threading import Lock, RLock
+
+import numpy as np
+import ctypes
+
+class PooledFrame(object):
+    """ A buffer from a FramePool. The array is re-used once every holder
+        of the frame has called release() so must not be kept after that """
+
+    __slots__ = ('pool', 'array', '_count')
+
+    def __init__(self, pool, array):
+        self.pool   = pool
+        self.array  = array
+        self._count = 0
+
+    def retain(self):
+        """ Adds a holder of the frame and returns it """
+        with self.pool._lock:
+            if self._count <= 0:
+                raise ValueError("frame has already been returned to its pool")
+            self._count += 1
+        return self
+
+    def release(self):
+        """ Removes a holder of the frame, returning it to the pool if it was the last """
+        with self.pool._lock:
+            if self._count <= 0:
+                raise ValueError("frame has already been returned to its pool")
+            self._count -= 1
+            if self._count == 0:
+                self.pool._free.append(self)
+        return
+
+    def holders(self):
+        return self._count
+
+    def pointer(self, ctype=ctypes.c_ubyte):
+        """ Returns a ctypes pointer to the start of the array, for filling it from C """
+        return self.array.ctypes.data_as(ctypes.POINTER(ctype))
+
+class FramePool:
+    """ Holds size preallocated buffers of one shape and dtype. If every buffer
+        is in use, acquire() allocates another unless the pool already has limit
+        buffers, in which case it returns None and the frame should be dropped """
+
+    def __init__(self, shape, dtype=np.uint8, size=4, limit=None):
+
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.limit = limit
+
+        self._lock   = Lock()
+        self._frames = []
+        self._free   = []
+
+        # Counters
+
+        self.acquired  = 0
+        self.grown     = 0      # Buffers allocated after the pool was made
+        self.exhausted = 0      # Calls to acquire() that returned None
+
+        for i in range(size):
+            self._free.append(self.allocate())
+
+    def __len__(self):
+        return len(self._frames)
+
+    def allocate(self):
+        frame = PooledFrame(self, np.empty(self.shape, self.dtype))
+        self._frames.append(frame)
+        return frame
+
+    def acquire(self):
+        """ Returns a free PooledFrame with one holder, or None if there are none """
+        with self._lock:
+            if self._free:
+                frame = self._free.pop()
+            elif self.limit is None or len(self._frames) < self.limit:
+                frame = self.allocate()
+                self.grown += 1
+            else:
+                self.exhausted += 1
+                return None
+            frame._count = 1
+            self.acquired += 1
+        return frame
+
+    def available(self):
+        """ Returns the number of buffers not being held """
+        return len(self._free)
+
+    def stats(self):
+        with self._lock:
+            return {"buffers": len(self._frames), "free": len(self._free), "acquired": self.acquired,
+                    "grown": self.grown, "exhausted": self.exhausted}
+
+class FrameRing:
+    """ Keeps the last size frames published to a stream, numbered in the
+        order they arrived. drain() returns every frame published since the
+        last drain, so a consumer that falls behind by fewer than size frames
+        loses none. Frames pushed out of the ring are passed to release(), if
+        given, and counted as overwritten if they had not been drained """
+
+    def __init__(self, size=8, release=None):
+
+        if size < 1:
+            raise ValueError("size must be at least 1")
+
+        self.size = size
+
+        self._release = release
+        self._lock    = RLock()
+        self._items   = [None] * size
+
+        self._cursor = 0        # Sequence number of the next frame to drain
+
+        # Counters
+
+        self.published   = 0    # Also the sequence number of the next frame
+        self.drained     = 0
+        self.overwritten = 0    # Pushed out of the ring before being drained
+        self.dropped     = 0    # Never published, see drop()
+
+    def __len__(self):
+        return min(self.published, self.size)
+
+    def publish(self, item):
+        """ Adds a frame to the ring and returns its sequence number """
+        with self._lock:
+            seq  = self.published
+            slot = seq % self.size
+            old  = self._items[slot]
+            if old is not None:
+                if old[0] >= self._cursor:
+                    self.overwritten += 1
+                if self._release is not None:
+                    self._release(old[1])
+            self._items[slot] = (seq, item)
+            self.published += 1
+        return seq
+
+    def drop(self):
+        """ Counts a frame the producer could not publish, e.g. for want of a buffer """
+        with self._lock:
+            self.dropped += 1
+        return
+
+    def since(self, seq, retain=None):
+        """ Returns a list of (seq, frame) for the frames from seq onwards that are
+            still in the ring. retain(frame) is called on each before the ring can
+            release it """
+        with self._lock:
+            start = max(seq, self.published - self.size)
+            items = [self._items[n % self.size] for n in range(start, self.published)]
+            if retain is not None:
+                for n, item in items:
+                    retain(item)
+        return items
+
+    def drain(self, retain=None):
+        """ Returns a list of (seq, frame) for every frame published since the last drain """
+        with self._lock:
+            items = self.since(self._cursor, retain) if self._cursor < self.published else []
+            self._cursor = self.published
+            self.drained += len(items)
+        return items
+
+    def last(self, retain=None):
+        """ Returns the most recent frame, or None """
+        with self._lock:
+            if self.published == 0:
+                return None
+            item = self._items[(self.published - 1) % self.size][1]
+            if retain is not None:
+                retain(item)
+        return item
+
+    def pending(self):
+        """ Returns the number of frames that drain() would return """
+        with self._lock:
+            return self.published - max(self._cursor, self.published - self.size)
+
+    def stats(self):
+        with self._lock:
+            return {"published": self.published, "drained": self.drained,
+                    "overwritten": self.overwritten, "dropped": self.dropped}
@@ -94,6 +94,8 @@ def CreateEnvironment():
 
     if not isfile(DATABASE):
         CreateDatabase(DATABASE)
+    else:
+        UpgradeDatabase(DATABASE)
 
     return True
 
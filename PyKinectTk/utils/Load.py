@@ -6,52 +6,120 @@
 
 from SQL import *
 from Env import *
+from Pack import NUM_JOINTS, NO_PIXEL
 
 import Skeleton
 
+import numpy as np
+
 def BodyData(p_id):
-    
-    # Load the performance Data
+    """ Returns a list of Skeleton.Body objects holding the joint data of a performance """
 
-    with Database(DATABASE) as db:
-        table = JOINT_DATA_TABLE, BODY_TIME_TABLE, BODY_NAME_TABLE
-        
-        # Load the co-ordinates and frame timestamps
-        
-        data = db.query(JOINT_DATA_TABLE, p_id)
-        time = db.query(BODY_TIME_TABLE, p_id)
+    return BodyArrays(p_id).bodies()
 
-        # Load any custom name labels for the bodies
+class BodyArrays:
+    """ Loads the body data of a performance into dense NumPy arrays indexed
+        by frame number and body:
 
-        role = [r[0] for r in db.query(BODY_NAME_TABLE, p_id, columns=("name",))]
-        
-    # Convert time to a dict
+            positions   (frames, bodies, 25, 3) float32, x, y, z in metres
+            pixels      (frames, bodies, 25, 2) float32, x, y in colour image pixels
+            tracking    (frames, bodies, 25)    uint8, tracking state of each joint
+            mask        (frames, bodies)        bool, True where a body has data
+            time        (frames,)               float64, timestamp of each frame (NaN if unknown)
 
-    time = dict([(row['frame'], row['time']) for row in time])
+        Missing positions and pixels are NaN """
 
-    num_bodies = max([row['body'] for row in data]) + 1
-    
-    bodies = [Skeleton.Body(name=(role[n] if n < len(role) else n)) for n in range(num_bodies)]
+    def __init__(self, p_id):
 
-    for row in data:
-        
-        body  = bodies[row['body']]
+        with Database(DATABASE) as db:
+
+            # Load the co-ordinates and frame timestamps
+
+            rows = db.query_values(JOINT_DATA_TABLE, p_id, ("frame", "body", "joint_id", "x", "y", "z", "pixel_x", "pixel_y", "tracking_state"))
+            time = db.query_values(BODY_TIME_TABLE, p_id, ("frame", "time"))
+
+            # Performances recorded with packed=True store one row per body per frame
+
+            if SKELETON_DATA_TABLE in db.tables():
+
+                packed = db.query_values(SKELETON_DATA_TABLE, p_id, ("frame", "body", "positions", "pixels", "tracking_states"))
+
+            else:
+
+                packed = []
+
+            # Load any custom name labels for the bodies
+
+            role = [r[0] for r in db.query(BODY_NAME_TABLE, p_id, columns=("name",))]
+
+        rows   = np.array(rows, dtype=np.float64).reshape(-1, 9)
+        time   = np.array(time, dtype=np.float64).reshape(-1, 2)
+        keys   = np.array([row[:2] for row in packed], dtype=np.int64).reshape(-1, 2)
+
+        # Size of the arrays
+
+        frames = rows[:, 0].astype(np.int64)
+        bodies = rows[:, 1].astype(np.int64)
 
-        joint = body[row['joint_id']]
+        num_frames = int(max([frames.max() + 1 if len(frames) else 0, keys[:, 0].max() + 1 if len(keys) else 0, time[:, 0].max() + 1 if len(time) else 0]))
+        num_bodies = int(max([bodies.max() + 1 if len(bodies) else 0, keys[:, 1].max() + 1 if len(keys) else 0]))
 
-        # Assign 3D co-ordinates (m) in 2dp
+        self.names = [role[n] if n < len(role) else n for n in range(num_bodies)]
 
-        joint[row['frame']] = [f for f in (row['x'], row['y'], row['z'])]
+        self.positions = np.full((num_frames, num_bodies, NUM_JOINTS, 3), np.nan, np.float32)
+        self.pixels    = np.full((num_frames, num_bodies, NUM_JOINTS, 2), np.nan, np.float32)
+        self.tracking  = np.zeros((num_frames, num_bodies, NUM_JOINTS), np.uint8)
+        self.mask      = np.zeros((num_frames, num_bodies), bool)
 
-        # Add 2D co-ordinates (px)
+        self.time = np.full(num_frames, np.nan)
+        self.time[time[:, 0].astype(np.int64)] = time[:, 1]
 
-        joint.add(row['frame'], row['pixel_x'], row['pixel_y'])
+        # One row per joint per body per frame
 
-        # Get the real time values and add to BODY object
+        joints = rows[:, 2].astype(np.int64)
 
-        body.frame_time(row['frame'], time[row['frame']])
+        self.positions[frames, bodies, joints] = rows[:, 3:6]
+        self.pixels[frames, bodies, joints]    = rows[:, 6:8]
+        self.tracking[frames, bodies, joints]  = rows[:, 8]
+        self.mask[frames, bodies] = True
 
-    return bodies
+        # One row per body per frame
+
+        if len(packed):
+
+            frames, bodies = keys[:, 0], keys[:, 1]
+
+            pixels = np.fromstring("".join(str(row[3]) for row in packed), np.int16).reshape(-1, NUM_JOINTS, 2)
+
+            self.positions[frames, bodies] = np.fromstring("".join(str(row[2]) for row in packed), np.float32).reshape(-1, NUM_JOINTS, 3)
+            self.pixels[frames, bodies]    = np.where(pixels == NO_PIXEL, np.nan, pixels)
+            self.tracking[frames, bodies]  = np.fromstring("".join(str(row[4]) for row in packed), np.uint8).reshape(-1, NUM_JOINTS)
+            self.mask[frames, bodies] = True
+
+    def __len__(self):
+        return len(self.time)
+
+    def num_bodies(self):
+        return self.mask.shape[1]
+
+    def frames(self, body=None):
+        """ Returns an array of the frame numbers with data (for one body, or any body) """
+        return np.flatnonzero(self.mask[:, body] if body is not None else self.mask.any(axis=1))
+
+    def bodies(self):
+        """ Returns a list of Skeleton.Body objects using the data in the arrays """
+
+        bodies = []
+
+        for b, name in enumerate(self.names):
+
+            body = Skeleton.Body(name=name)
+
+            body.set_data(self.positions[:, b], self.pixels[:, b], self.tracking[:, b], self.mask[:, b], self.time)
+
+            bodies.append(body)
+
+        return bodies
 
 def VideoData(p_id):
     """ Takes a performance id and returns a dictionary of frame numbers and their timestamps """
@@ -66,26 +134,47 @@ def VideoData(p_id):
 
     return dict([(row['frame'], row['time']) for row in data])
 
+def Duration(p_id, streams=("body", "video")):
+    """ Returns the timestamp of the last frame in any of the streams of a performance """
+
+    tables = {"body": (BODY_TIME_TABLE, "time"), "video": (VIDEO_TIME_TABLE, "time"), "audio": (AUDIO_TIME_TABLE, "end_time")}
+
+    with Database(DATABASE) as db:
+
+        times = [db.query_values(tables[stream][0], p_id, ("MAX(%s)" % tables[stream][1],))[0][0] for stream in streams]
+
+    return max([t for t in times if t is not None] or [0])
+
+#: Policies for choosing the frame at a time that falls between two frames
+PREVIOUS, NEAREST, NEXT = "previous", "nearest", "next"
+
 class FrameTime:
+    """ Maps the frames of a stream to their timestamps and back. The frames
+        are held in arrays sorted by time so lookups are binary searches """
 
-    def __init__(self, frametime):
+    def __init__(self, frametime, policy=PREVIOUS):
 
         self.frametimes = frametime
-        
-        self.frames = sorted(frametime.keys())[:-1]
-        self.times  = sorted(frametime.values())
+
+        self.policy = policy
+
+        frames = np.array(list(frametime.keys()), int)
+        times  = np.array([frametime[f] for f in frames], float)
+
+        order = np.argsort(times, kind="mergesort")
+
+        self.frames = frames[order]
+        self.times  = times[order]
 
         self.l = len(self.frametimes)
 
-        try:
-            self.max_t = self.times[-1]
-        except:
-            self.max_t = 0
+        # A frame is shown until the next one, or for one frame period after the last
+
+        self.period = float(np.median(np.diff(self.times))) if self.l > 1 else 0.0
 
-        try:
-            self.max_f = self.frames[-1]
-        except:
-            self.max_f = 0
+        self.min_t = float(self.times[0])  if self.l else 0
+        self.max_t = float(self.times[-1]) if self.l else 0
+        self.max_f = int(self.frames.max()) if self.l else 0
 
     def __len__(self):
         return self.l
@@ -93,6 +182,9 @@ class FrameTime:
     def size(self):
         return self.l
 
+    def min_time(self):
+        return self.min_t
+
     def max_time(self):
         return self.max_t
 
@@ -117,18 +209,64 @@ class FrameTime:
 
         return self.frametimes[frame]
 
-    def frame_at_time(self, time):
+    def indices(self, times, policy=None):
+        """ Returns the positions in self.frames of the frames at each of times,
+            with -1 where there is no frame """
+
+        policy = self.policy if policy is None else policy
+
+        times = np.asarray(times, float)
+
+        if self.l == 0:
+
+            return np.full(times.shape, -1, int)
+
+        last = self.l - 1
 
-        for i in range(len(self.frames)-1):
+        if policy == PREVIOUS:
 
-            if time <= self.frametimes[self.frames[i+1]]:
+            i = np.searchsorted(self.times, times, side="right") - 1
 
-                return self.frames[i]
+            missing = (i < 0) | (times > self.max_t + self.period)
+
+        elif policy == NEXT:
+
+            i = np.searchsorted(self.times, times, side="left")
+
+            missing = i > last
+
+        elif policy == NEAREST:
+
+            after  = np.minimum(np.searchsorted(self.times, times), last)
+            before = np.maximum(after - 1, 0)
+
+            i = np.where(np.abs(times - self.times[before]) <= np.abs(self.times[after] - times), before, after)
+
+            missing = np.zeros(times.shape, bool)
 
         else:
 
+            raise ValueError("Unknown policy '%s'" % policy)
+
+        return np.where(missing, -1, i)
+
+    def frame_at_times(self, times, policy=None):
+        """ Returns an array of the frames at each of times, with -1 where there is no frame """
+
+        i = self.indices(times, policy)
+
+        return np.where(i < 0, -1, self.frames[np.maximum(i, 0)] if self.l else -1)
+
+    def frame_at_time(self, time, policy=None):
+
+        i = int(self.indices(time, policy))
+
+        if i < 0:
+
             raise TimeIndexError("No frame found at time '{}'".format(time))
 
+        return int(self.frames[i])
+
 def PerformanceID(PerformanceName):
     """ Returns the ID number of a recording based on a name - case invariant.
         Raises an error if not found """
@@ -156,6 +294,8 @@ def DeletePerformance(p_id):
 
                 db.delete(tbl, "performance_id = %s" % str(p_id))
 
+        db.save()
+
     return True
 
 
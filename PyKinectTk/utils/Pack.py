@@ -0,0 +1,45 @@
+"""
+    Pack.py
+
+    Converts the joints of one body at one frame to and from the
+    blobs stored in the tbl_SkeletonData table
+
+"""
+
+from SQL import Blob
+
+import numpy as np
+
+__all__ = ['pack_skeleton', 'unpack_skeleton', 'NUM_JOINTS', 'NO_PIXEL']
+
+NUM_JOINTS = 25
+
+#: Stored in place of pixel co-ordinates that are not finite (joints the Kinect could not map)
+NO_PIXEL = np.iinfo(np.int16).min
+
+def pack_skeleton(positions, pixels, tracking_states):
+    """ Takes the x, y, z positions, pixel x, y co-ordinates and tracking states
+        of all 25 joints and returns them as three Blobs (float32, int16, uint8) """
+
+    positions = np.asarray(positions, np.float32)
+
+    pixels = np.asarray(pixels, np.float64)
+    valid  = np.isfinite(pixels)
+    pixels = np.where(valid, np.clip(np.round(pixels), NO_PIXEL + 1, np.iinfo(np.int16).max), NO_PIXEL).astype(np.int16)
+
+    tracking_states = np.asarray(tracking_states, np.uint8)
+
+    return Blob(positions.tostring()), Blob(pixels.tostring()), Blob(tracking_states.tostring())
+
+def unpack_skeleton(positions, pixels, tracking_states):
+    """ Returns arrays of positions (25 x 3, float32), pixels (25 x 2, float32
+        with NaN for joints that had no pixel) and tracking states (25, uint8) """
+
+    positions = np.frombuffer(positions, np.float32).reshape(NUM_JOINTS, 3)
+
+    pixels = np.frombuffer(pixels, np.int16).reshape(NUM_JOINTS, 2)
+    pixels = np.where(pixels == NO_PIXEL, np.nan, pixels).astype(np.float32)
+
+    tracking_states = np.frombuffer(tracking_states, np.uint8)
+
+    return positions, pixels, tracking_states
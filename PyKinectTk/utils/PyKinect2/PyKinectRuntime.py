@@ -1,6 +1,8 @@
 import PyKinectV2
 from PyKinectV2 import *
 
+from ..Buffers import FramePool, FrameRing
+
 import ctypes
 import _ctypes 
 from _ctypes import COMError
@@ -87,6 +89,7 @@ class PyKinectRuntime(object):
 
         self._color_source = self._sensor.ColorFrameSource 
         self.color_frame_desc = self._color_source.FrameDescription
+        self.resolution = (self.color_frame_desc.Width, self.color_frame_desc.Height)
         self._depth_source = self._sensor.DepthFrameSource 
         self.depth_frame_desc = self._depth_source.FrameDescription 
         self._body_index_source = self._sensor.BodyIndexFrameSource 
@@ -97,7 +100,6 @@ class PyKinectRuntime(object):
 
         self._audio_source = self._sensor.AudioSource        
 
-        self._color_frame_data = None 
         self._depth_frame_data = None 
         self._body_frame_data = None
         self._body_index_frame_data = None
@@ -118,10 +120,9 @@ class PyKinectRuntime(object):
             self._waitHandleCount += 1
 
         if(self.frame_source_types & FrameSourceTypes_Color):
-            self._color_frame_data = ctypes.POINTER(ctypes.c_ubyte) 
             self._color_frame_data_capacity = ctypes.c_uint(self.color_frame_desc.Width * self.color_frame_desc.Height * 4)
-            self._color_frame_data_type = ctypes.c_ubyte * self._color_frame_data_capacity.value
-            self._color_frame_data = ctypes.cast(self._color_frame_data_type(), ctypes.POINTER(ctypes.c_ubyte))
+            # Frames are converted straight into these buffers and handed out without copying
+            self._color_frame_pool = FramePool((self.color_frame_desc.Height, self.color_frame_desc.Width, 4), numpy.uint8, size=4, limit=40)
             self._color_frame_reader = self._color_source.OpenReader()
             self._color_frame_arrived_event = self._color_frame_reader.SubscribeFrameArrived()
             self._handles[self._waitHandleCount] = self._color_frame_arrived_event
@@ -158,8 +159,6 @@ class PyKinectRuntime(object):
             self._handles[self._waitHandleCount] = self._body_frame_arrived_event
             self._waitHandleCount += 1
 
-        thread.start_new_thread(self.kinect_frame_thread, ())
-
         self._last_color_frame = None
         self._last_depth_frame = None
         self._last_body_frame = None
@@ -177,6 +176,13 @@ class PyKinectRuntime(object):
         self._last_long_exposure_infrared_frame_access = self._last_long_exposure_infrared_frame_time = start_clock
         self._last_audio_frame_access = self._last_audio_frame_time = start_clock
 
+        # Every frame is also published to its stream's ring so none are lost between reads
+        self._color_frame_ring = FrameRing(8, release=KinectVideoFrameData.release)
+        self._body_frame_ring  = FrameRing(32)
+        self._audio_frame_ring = FrameRing(64)
+
+        thread.start_new_thread(self.kinect_frame_thread, ())
+
     def close(self):
         if self._sensor is not None:
             ctypes.windll.kernel32.SetEvent(self._close_event)
@@ -206,6 +212,10 @@ class PyKinectRuntime(object):
     def __exit__(self, *args):
         self.close()
 
+    def exhausted(self):
+        """ Returns False - a live stream never runs out of frames """
+        return False
+
     def surface_as_array(self, surface_buffer_interface):
        address = ctypes.c_void_p()
        size = self.Py_ssize_t()
@@ -245,21 +255,21 @@ class PyKinectRuntime(object):
 
 
     def get_last_color_frame(self):
-        """ Edited by Ryan Kirkbride -> sc10rpk@leeds.ac.uk """
+        """ Edited by Ryan Kirkbride -> sc10rpk@leeds.ac.uk
+
+            Returns the last KinectVideoFrameData without copying it. Its buffer
+            is re-used once released so the caller must call release() when done """
         with self._color_frame_lock:
-            if self._color_frame_data is not None:
-                #data = numpy.copy(numpy.ctypeslib.as_array(self._color_frame_data, shape=(self._color_frame_data_capacity.value,)))
-                _last_color_frame_access = time.clock()
-                #return data
-                return self._last_color_frame
-            else:
-                return None # shape=(self._color_frame_data_capacity.value,)
+            frame = self._color_frame_ring.last(KinectVideoFrameData.retain)
+            if frame is not None:
+                self._last_color_frame_access = time.clock()
+            return frame
 
     def get_last_depth_frame(self):
         with self._depth_frame_lock:
             if self._depth_frame_data is not None:
                 data = numpy.copy(numpy.ctypeslib.as_array(self._depth_frame_data, shape=(self._depth_frame_data_capacity.value,)))
-                _last_color_frame_access = time.clock()
+                self._last_depth_frame_access = time.clock()
                 return data
             else:
                 return None
@@ -268,7 +278,7 @@ class PyKinectRuntime(object):
         with self._body_index_frame_lock:
             if self._body_index_frame_data is not None:
                 data = numpy.copy(numpy.ctypeslib.as_array(self._body_index_frame_data, shape=(self._body_index_frame_data_capacity.value,)))
-                _last_color_frame_access = time.clock()
+                self._last_body_index_frame_access = time.clock()
                 return data
             else:
                 return None
@@ -276,7 +286,7 @@ class PyKinectRuntime(object):
     def get_last_body_frame(self):
         with self._body_frame_lock:
             if self._body_frame_bodies is not None:
-                _last_body_frame_access = time.clock()
+                self._last_body_frame_access = time.clock()
                 return self._body_frame_bodies.copy()
             else:
                 return None
@@ -292,6 +302,29 @@ class PyKinectRuntime(object):
             else:
                 return None
 
+    def get_new_color_frames(self):
+        """ Returns every colour frame received since the last call, oldest first.
+            Each must be released, as with get_last_color_frame() """
+        with self._color_frame_lock:
+            self._last_color_frame_access = time.clock()
+        return [frame for seq, frame in self._color_frame_ring.drain(KinectVideoFrameData.retain)]
+
+    def get_new_body_frames(self):
+        """ Returns every body frame received since the last call, oldest first """
+        with self._body_frame_lock:
+            self._last_body_frame_access = time.clock()
+        return [frame for seq, frame in self._body_frame_ring.drain()]
+
+    def get_new_audio_frames(self):
+        """ Returns every audio frame received since the last call, oldest first """
+        with self._audio_frame_lock:
+            self._last_audio_frame_access = time.clock()
+        return [frame for seq, frame in self._audio_frame_ring.drain()]
+
+    def ring_stats(self):
+        """ Returns a dict of stream -> published/drained/overwritten/dropped counters """
+        return {"color": self._color_frame_ring.stats(), "body": self._body_frame_ring.stats(), "audio": self._audio_frame_ring.stats()}
+
 
     def body_joint_to_color_space(self, joint):
         return self._mapper.MapCameraPointToColorSpace(joint.Position) 
@@ -339,13 +372,23 @@ class PyKinectRuntime(object):
             colorFrame = colorFrameRef.AcquireFrame()
             frameTime  = colorFrameRef.RelativeTime
             try:
-                with self._color_frame_lock:
-                    colorFrame.CopyConvertedFrameDataToArray(self._color_frame_data_capacity, self._color_frame_data, PyKinectV2.ColorImageFormat_Bgra)
-                    self._last_color_frame_time = time.clock()
-
-                    # Class stores the data & relative time
-                    data = numpy.copy(numpy.ctypeslib.as_array(self._color_frame_data, shape=(self._color_frame_data_capacity.value,)))
-                    self._last_color_frame = KinectVideoFrameData(data, frameTime)
+                # Convert into a free buffer from the pool, dropping the frame if all are held
+                frame = self._color_frame_pool.acquire()
+                if frame is None:
+                    self._color_frame_ring.drop()
+                else:
+                    published = False
+                    try:
+                        colorFrame.CopyConvertedFrameDataToArray(self._color_frame_data_capacity, frame.pointer(ctypes.c_ubyte), PyKinectV2.ColorImageFormat_Bgra)
+                        with self._color_frame_lock:
+                            # Class stores the data & relative time - the ring releases it once pushed out
+                            self._color_frame_ring.publish(KinectVideoFrameData(frame, frameTime))
+                            published = True
+                            self._last_color_frame_time = time.clock()
+                    finally:
+                        # Return the buffer to the pool if the ring never got it
+                        if not published:
+                            frame.release()
             except: 
                 pass
             colorFrame = None
@@ -378,6 +421,7 @@ class PyKinectRuntime(object):
 
                 # Class stores the data & relative time
                 self._last_audio_frame = KinectAudioFrameData(numpy.copy(self._audio_subframes), frameTime)
+                self._audio_frame_ring.publish(self._last_audio_frame)
                 
                 self._last_audio_frame_time = time.clock()
             except Exception as e:
@@ -439,6 +483,7 @@ class PyKinectRuntime(object):
                 with self._body_frame_lock:
                     bodyFrame.GetAndRefreshBodyData(self._body_frame_data_capacity, self._body_frame_data)
                     self._body_frame_bodies = KinectBodyFrameData(bodyFrame, self._body_frame_data, self.max_body_count, frameTime)
+                    self._body_frame_ring.publish(self._body_frame_bodies)
                     self._last_body_frame_time = time.clock()
 
                 # need these 2 lines as a workaround for handling IBody referencing exception 
@@ -562,9 +607,10 @@ class KinectAudioFrameData(object):
         return self.audio
 
 class KinectVideoFrameData(object):
+    """ Holds a PooledFrame containing a BGRA image (height, width, 4) by reference """
     def __init__(self, videoFrame, video_frame_relative_time):
-        data = numpy.array(videoFrame, dtype="uint8")
-        self.array = data.reshape([1080,1920,4])
+        self.frame = videoFrame
+        self.array = videoFrame.array
         self.time  = video_frame_relative_time
 
     def timestamp(self):
@@ -572,5 +618,12 @@ class KinectVideoFrameData(object):
 
     def data(self):
         return self.array
+
+    def retain(self):
+        self.frame.retain()
+        return self
+
+    def release(self):
+        self.frame.release()
        
       
@@ -6,6 +6,15 @@
 
 import sqlite3
 
+from time import time as now
+
+class Blob(str):
+    """ Binary data that is stored in the database as a BLOB. Unlike
+        sqlite3.Binary, it can be passed between processes """
+    pass
+
+sqlite3.register_adapter(Blob, sqlite3.Binary)
+
 class Database(object):
     """ Provides an easy-to-use wrapper for sqlite3 databases """
     def __init__(self, name):
@@ -44,6 +53,14 @@ class Database(object):
         self._db.execute("SELECT {} FROM {} WHERE performance_id={}".format(columns, table, p_id))
         return self._db.fetchall()
 
+    def query_values(self, table, p_id, columns):
+        """ Same as query() but returns plain tuples, which are quicker to
+            load into arrays than sqlite3.Row objects """
+        cursor = self._main.cursor()
+        cursor.row_factory = None
+        cursor.execute("SELECT {} FROM {} WHERE performance_id=?".format(",".join(columns), table), (p_id,))
+        return cursor.fetchall()
+
     def delete(self, table, condition):
         self._db.execute("DELETE FROM {} WHERE {}".format(table, condition))
         print "DELETE FROM {} WHERE {}".format(table, condition)
@@ -69,6 +86,19 @@ class Database(object):
         
         return
         
+    def create_index(self, index_name, table_name, columns):
+        """ Creates an index on the columns of a table if it does not already exist """
+
+        query = "CREATE INDEX IF NOT EXISTS %s ON %s (%s)" % (index_name, table_name, ",".join(columns))
+
+        self._db.execute(query)
+
+        return
+
+    def get_indexes(self):
+        self._db.execute("SELECT * FROM sqlite_master WHERE type='index'")
+        return [str(idx['name']) for idx in self._db.fetchall()]
+        
     def get_columns(self, table):
         self._db.execute("PRAGMA table_info(%s)" % table)
         return [str(column['name']) for column in self._db.fetchall()]
@@ -76,14 +106,15 @@ class Database(object):
     def columns(self, table):
         return self._tables[table]
     
+    def row(self, table, data):
+        """ Uses the column names of table to organise data (a list of
+            tuples (col, data)) into a list of values in column order """
+        data = dict(data)
+        return [data[col] for col in self.columns(table)]
+
     def insert(self, table, data):
         """ data should be a list of tuples (col, data) """
-        # Get column names of the table
-        columns = self.columns(table)
-        
-        # Use names to organise data into an acceptable row
-        data = dict(data)
-        row  = [data[col] for col in columns]
+        row = self.row(table, data)
         
         # Insert
         query = "INSERT INTO {} VALUES (%s)".format(table) % ','.join((["?"]*len(row)))
@@ -92,6 +123,15 @@ class Database(object):
         
         return
 
+    def insert_many(self, table, rows):
+        """ rows should be a sequence of lists/tuples with values in the
+            same order as the columns of the table """
+        query = "INSERT INTO {} VALUES (%s)".format(table) % ','.join((["?"]*len(self.columns(table))))
+
+        self._db.executemany(query, rows)
+
+        return
+
     def update(self, table, column, new, identifier, value):
         """ e.g. db.update(tbl1, name, ryan, id, 3) updates the name of tbl1 with id 3 to Ryan """
 
@@ -117,6 +157,64 @@ class Database(object):
         self._main.close()
         del self
 
+class InsertBuffer(object):
+    """ Accumulates rows for each table and writes them to a Database using
+        executemany, committing once max_rows rows have been added or
+        max_wait seconds have passed since the last commit """
+
+    def __init__(self, database, max_rows=2000, max_wait=1.0):
+
+        self._database = database
+
+        self._rows  = {}    # Dict of table name -> list of rows
+        self._count = 0
+
+        self._max_rows = max_rows
+        self._max_wait = max_wait
+
+        self._last_flush = now()
+
+    def __len__(self):
+        return self._count
+
+    def add(self, table, row):
+        """ Adds a single row (values in column order) to be written to table """
+        self._rows.setdefault(table, []).append(row)
+        self._count += 1
+        self.flush_if_due()
+        return
+
+    def extend(self, table, rows):
+        """ Adds a list of rows (values in column order) to be written to table """
+        self._rows.setdefault(table, []).extend(rows)
+        self._count += len(rows)
+        self.flush_if_due()
+        return
+
+    def due(self):
+        """ Returns True if the buffer is full or has not been written for max_wait seconds """
+        return self._count >= self._max_rows or (now() - self._last_flush) >= self._max_wait
+
+    def flush_if_due(self):
+        if self.due():
+            self.flush()
+        return
+
+    def flush(self):
+        """ Writes all buffered rows in a single transaction """
+        for table, rows in self._rows.items():
+            if rows:
+                self._database.insert_many(table, rows)
+        self._database.save()
+        self._rows  = {}
+        self._count = 0
+        self._last_flush = now()
+        return
+
+    def close(self):
+        self.flush()
+        return
+
 # Database Constants
 
 JOINT_NAMES_TABLE  = "tbl_JointNames"
@@ -132,6 +230,66 @@ JOINT_DATA_TABLE        = "tbl_JointData"
 HAND_DATA_TABLE         = "tbl_HandData"
 BODY_TIME_TABLE         = "tbl_BodyTime"
 BODY_NAME_TABLE         = "tbl_BodyName"
+SKELETON_DATA_TABLE     = "tbl_SkeletonData"
+
+# Indexes on the performance data tables: (index name, table, columns)
+
+INDEXES = [("idx_PerformanceName", PERFORMANCE_NAME_TABLE, ("performance_id",)),
+           ("idx_JointData",       JOINT_DATA_TABLE,       ("performance_id", "frame", "body", "joint_id")),
+           ("idx_HandData",        HAND_DATA_TABLE,        ("performance_id", "frame", "body")),
+           ("idx_SkeletonData",    SKELETON_DATA_TABLE,    ("performance_id", "frame", "body")),
+           ("idx_BodyTime",        BODY_TIME_TABLE,        ("performance_id", "frame")),
+           ("idx_BodyName",        BODY_NAME_TABLE,        ("performance_id", "body")),
+           ("idx_VideoPath",       VIDEO_PATH_TABLE,       ("performance_id",)),
+           ("idx_VideoTime",       VIDEO_TIME_TABLE,       ("performance_id", "frame")),
+           ("idx_AudioPath",       AUDIO_PATH_TABLE,       ("performance_id",)),
+           ("idx_AudioTime",       AUDIO_TIME_TABLE,       ("performance_id",))]
+
+def CreateIndexes(db, verbose=False):
+    """ Adds any missing indexes to the performance data tables of an open Database """
+
+    tables  = db.get_tables()
+    indexes = db.get_indexes()
+
+    for index_name, table, columns in INDEXES:
+
+        if table in tables and index_name not in indexes:
+
+            if verbose:
+
+                print "Indexing %s..." % table
+            
+            db.create_index(index_name, table, columns)
+
+    db.save()
+
+    return
+
+def CreateSkeletonTable(db):
+    """ Table storing all 25 joints of a body in one row per frame. The
+        positions (float32 x, y, z), pixels (int16 x, y) and tracking
+        states (uint8) are packed into blobs - see Pack.py """
+
+    db.create_table(SKELETON_DATA_TABLE, [("performance_id","integer"),
+                                          ("body","integer"),
+                                          ("frame","integer"),
+                                          ("positions","blob"),
+                                          ("pixels","blob"),
+                                          ("tracking_states","blob")])
+    return
+
+def UpgradeDatabase(filename):
+    """ Brings a database created by an older version of PyKinectTk up to date """
+
+    with Database(filename) as db:
+
+        if SKELETON_DATA_TABLE not in db.get_tables():
+
+            CreateSkeletonTable(db)
+
+        CreateIndexes(db, verbose=True)
+
+    return True
 
 def CreateDatabase(filename):
     """ Creates the database and adds tables used by all performance data tables """
@@ -195,6 +353,8 @@ def CreateDatabase(filename):
                                       ("right_hand_state","integer"),
                                       ("right_hand_confidence","real")])
 
+    CreateSkeletonTable(db)
+
     db.create_table(VIDEO_PATH_TABLE, [("performance_id","integer"),
                                        ("path","text"),
                                        ("start_time","real")])
@@ -211,6 +371,10 @@ def CreateDatabase(filename):
                                        ("end_time","real")])
 
     db.save()
+
+    # Indexes so that loading one performance does not scan the whole table
+
+    CreateIndexes(db)
     db.close()
 
     return True
@@ -1,7 +1,24 @@
+import numpy as np
+
 class HashList:
     """ A tuple-like array that supports addressing by string values """
     def __init__(self, *args):
         self.contents = tuple(args)
+        self.reindex()
+
+    def reindex(self):
+        """ Builds the case-insensitive map of item names to their indices """
+        self._index = {}
+        for i, item in enumerate(self.contents):
+            self._index.setdefault(str(item).lower(), i)
+        return
+
+    def index(self, key):
+        """ Returns the index of the item named key """
+        try:
+            return self._index[key.lower()]
+        except KeyError:
+            raise KeyError("String key '%s' not found." % key)
 
     def __len__(self):
         return len(self.contents)
@@ -14,16 +31,13 @@ class HashList:
         return str(self.contents)
 
     def __getitem__(self, key):
-        if type(key) is int:
+        if isinstance(key, (int, long, np.integer)):
             if key < len(self):
                 return self.contents[key]
             else:
                 raise IndexError("Sequence index out of range.")
-        if type(key) is str:
-            for item in self.contents:
-                if item == key:
-                    return item
-            raise KeyError("String key '%s' not found." % key)
+        if isinstance(key, basestring):
+            return self.contents[self.index(key)]
         raise TypeError
 
     def __setitem__(self, key, value):
@@ -31,22 +45,58 @@ class HashList:
 
 
 
-class Joint:
+def resized(array, size, fill):
+    """ Returns a copy of array with its first dimension extended to size """
+    new = np.full((size,) + array.shape[1:], fill, array.dtype)
+    new[:len(array)] = array
+    return new
+
+class Joint(object):
     """ Represents a Kinect Skeleton Joint with a 3D (real plane)
-        and 2D (pixel plane) state that changes over time """
+        and 2D (pixel plane) state that changes over time. The states
+        are held in arrays indexed by frame number with a mask of the
+        frames that have data """
+
+    __slots__ = ('_name', '_id', '_real', '_view', '_state', '_mask', '_children', '_parent')
 
     def __init__(self, name, joint_id=None):
 
         self._name = name
         self._id = joint_id
 
-        self._view = {} # Dict of frame no. -> 2D co-ords
-        self._real = {} # Dict of frame no. -> 3D co-ords
-        self._time = {}
+        self._real  = np.empty((0, 3), np.float32)  # Array of frame no. -> 3D co-ords
+        self._view  = np.empty((0, 2), np.float32)  # Array of frame no. -> 2D co-ords
+        self._state = np.empty(0, np.uint8)         # Array of frame no. -> tracking state
+        self._mask  = np.empty(0, bool)             # Array of frame no. -> has data
         
         self._children = []
         self._parent = None
 
+    def set_data(self, real, view, state, mask):
+        """ Uses arrays indexed by frame number as the joint's data. They are copied
+            into contiguous arrays of its own so setters do not change the originals """
+        self._real  = np.array(real, order='C')
+        self._view  = np.array(view, order='C')
+        self._state = np.array(state, order='C')
+        self._mask  = np.array(mask, bool, order='C')
+        return
+
+    def reserve(self, frame):
+        """ Makes sure the arrays have room for frame """
+        size = len(self._mask)
+        if frame >= size:
+            size = max(frame + 1, 2 * size)
+            self._real  = resized(self._real, size, np.nan)
+            self._view  = resized(self._view, size, np.nan)
+            self._state = resized(self._state, size, 0)
+            self._mask  = resized(self._mask, size, False)
+        return
+
+    def check(self, t):
+        if t not in self:
+            raise KeyError(t)
+        return t
+
     def set_id(self, number):
         self._id = number
         return
@@ -70,26 +120,37 @@ class Joint:
         return str(self._name)
 
     def __iter__(self):
-        for value in self._view:
+        for value in self.keys():
             yield value
 
     def __getitem__(self, key):
-        return self._real[key]
+        return self._real[self.check(key)].tolist()
+
+    def frames(self):
+        """ Returns an array of the frame numbers with data """
+        return np.flatnonzero(self._mask)
 
     def keys(self):
-        return sorted(self._real.keys())
+        return self.frames().tolist()
 
     def __setitem__(self, key, value):
+        self.reserve(key)
         self._real[key] = value
+        self._mask[key] = True
 
     def __contains__(self, key):
-        return key in self._view
+        return 0 <= key < len(self._mask) and bool(self._mask[key])
 
     def add(self, t, x, y):
+        self.reserve(t)
         self._view[t] = (x, y)
+        self._mask[t] = True
 
     def pixel(self, t):
-        return self._view[t]
+        return tuple(self._view[self.check(t)].tolist())
+
+    def tracking(self, t):
+        return int(self._state[self.check(t)])
 
     def bones(self, t):
         return [(self.pixel(t), child.pixel(t)) for child in self._children]
@@ -98,28 +159,26 @@ class Joint:
         return [(self.position(t), child.position(t)) for child in self._children]
     
     def position(self, t):
-        return self._real[t]
+        return self[t]
 
     @staticmethod
     def index(axis):
         return "xyz".index(axis.lower())
 
+    def series(self, axis):
+        """ Returns an array of the values on one axis for each frame with data """
+        return self._real[self._mask, self.index(axis)]
+
     def separate(self, axis="xyz"):
         d={}
         for a in axis:
-            d[a] = dict([(frame, self._real[frame][self.index(a)]) for frame in sorted(self._real.keys())])
+            d[a] = self.get(a)
         return d
 
     def get(self, axis):
-        if axis in "xX":
-            n = 0
-        elif axis in "yY":
-            n = 1
-        elif axis in "zZ":
-            n = 2
-        else:
+        if axis not in "xXyYzZ" or len(axis) != 1:
             raise ValueError("Axis must be X, Y, or Z")
-        return dict([(frame, value[n]) for frame, value in self._real.items()])
+        return dict(zip(self.keys(), self.series(axis).tolist()))
     
     def get_all(self, axis, frame=None):
         if axis in "xX":
@@ -134,21 +193,21 @@ class Joint:
 
     def x(self, t=None):
         if t is not None:
-            return  self._real[t][0]
+            return float(self._real[self.check(t), 0])
         else:
-            return [self._real[t][0] for t in sorted(self._real.keys())]
+            return self.series("x").tolist()
 
     def y(self, t=None):
         if t is not None:
-            return  self._real[t][1]
+            return float(self._real[self.check(t), 1])
         else:
-            return [self._real[t][1] for t in sorted(self._real.keys())]
+            return self.series("y").tolist()
 
     def z(self, t=None):
         if t is not None:
-            return  self._real[t][2]
+            return float(self._real[self.check(t), 2])
         else:
-            return [self._real[t][2] for t in sorted(self._real.keys())]
+            return self.series("z").tolist()
 
     def children(self):
         return self._children
@@ -232,12 +291,21 @@ class Joints(HashList):
         self[17].add_child(self[18])
         self[18].add_child(self[19])
 
+        # Precompute the bones as arrays of parent and child joint indices
+
+        bones = [(joint.ID(), child.ID()) for joint in self for child in joint.children()]
+
+        self.bone_parents  = np.array([parent for parent, child in bones], int)
+        self.bone_children = np.array([child for parent, child in bones], int)
+
     def __str__(self):
         return str([str(j) for j in self])
 
-class Body:
+class Body(object):
     """ Body(Joints()) returns an 'empty' body """
 
+    __slots__ = ('_joints', '_id', '_time', '_mask', '_name')
+
     def __init__(self, joints=None, tracking_id=None, name="Null"):
 
         if joints is not None:
@@ -247,7 +315,8 @@ class Body:
             
         self._id = tracking_id
 
-        self._time = {} # Dict of frame no. -> real time val
+        self._time = np.empty(0)        # Array of frame no. -> real time val
+        self._mask = np.empty(0, bool)  # Array of frame no. -> has data
 
         self._name = name
 
@@ -267,21 +336,50 @@ class Body:
         for j in self._joints:
             yield j
 
+    def set_data(self, positions, pixels, tracking, mask, time):
+        """ Uses arrays indexed by frame number as the body's data: positions (frames, 25, 3),
+            pixels (frames, 25, 2), tracking (frames, 25), mask (frames,) and time (frames,).
+            The body and its joints keep copies, so the arrays can be shared between bodies """
+        self._mask = np.array(mask, bool, order='C')
+        self._time = np.array(time, order='C')
+        for j, joint in enumerate(self._joints):
+            joint.set_data(positions[:, j], pixels[:, j], tracking[:, j], mask)
+        return
+
+    def pixels(self, t):
+        """ Returns an array of the 2D co-ords of every joint at frame t """
+        return np.array([joint._view[t] for joint in self._joints])
+
+    def bones(self, t):
+        """ Returns arrays of the start and end 2D co-ords of every bone at frame t """
+        pixels = self.pixels(t)
+        return pixels[self._joints.bone_parents], pixels[self._joints.bone_children]
+
     def frame_time(self, frame, t=None):
         if t is not None:
+            if frame >= len(self._mask):
+                size = max(frame + 1, 2 * len(self._mask))
+                self._time = resized(self._time, size, np.nan)
+                self._mask = resized(self._mask, size, False)
             self._time[frame] = t
-        return self._time[frame]
+            self._mask[frame] = True
+        if not self.hasData(frame):
+            raise KeyError(frame)
+        return float(self._time[frame])
 
     def time(self):
-        return self._time.values()
+        return self._time[self._mask].tolist()
 
     def frames(self):
-        return self._time.keys()
+        return np.flatnonzero(self._mask).tolist()
 
     def all_frame_time(self, timeframe=None):
+        frames = np.flatnonzero(self._mask)
+        times  = self._time[frames]
         if timeframe:
-            return dict([(frame, time) for frame, time in self._time.items() if timeframe[0] <= time <= timeframe[1]])
-        return self._time
+            inside = (times >= timeframe[0]) & (times <= timeframe[1])
+            frames, times = frames[inside], times[inside]
+        return dict(zip(frames.tolist(), times.tolist()))
 
     def num_bones(self):
         num = 0
@@ -290,8 +388,8 @@ class Body:
         return num
 
     def hasData(self, t):
-        """ returns the a bool of whether the head node has data """
-        return t in self._joints['Head']
+        """ returns the a bool of whether the body has data at frame t """
+        return 0 <= t < len(self._mask) and bool(self._mask[t])
         
 
 class State:
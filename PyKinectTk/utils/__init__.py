@@ -3,3 +3,5 @@ from Colour import *
 from Load import *
 from Env import *
 from SQL import *
+from Pack import *
+from Buffers import *
@@ -0,0 +1,70 @@
+"""
+    test_playback.py
+
+    Plays back synthetic recordings made in the working environment,
+    which are deleted afterwards.
+
+    Usage:
+
+        python -m unittest discover tests
+
+"""
+
+from PyKinectTk.utils import *
+from PyKinectTk.utils.SQL import *
+from PyKinectTk.Playback.Benchmark import SyntheticRecording, DeleteRecording, BenchmarkPlayer
+
+import unittest
+
+class ShortVideoTest(unittest.TestCase):
+    """ A video file with fewer frames than its tbl_VideoTime rows """
+
+    FRAMES = 60
+    EXTRA  = 30
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.p_id = SyntheticRecording(1, cls.FRAMES)
+
+        with Database(DATABASE) as db:
+
+            db.insert_many(VIDEO_TIME_TABLE, [(cls.p_id, frame, frame / 30.0) for frame in range(cls.FRAMES, cls.FRAMES + cls.EXTRA)])
+
+            db.save()
+
+    @classmethod
+    def tearDownClass(cls):
+
+        DeleteRecording(cls.p_id)
+
+    def play(self, reuse):
+        """ Returns the sum of each frame rendered """
+
+        player = BenchmarkPlayer(self.p_id, reuse=reuse, size=(320, 180), body=False, info=False)
+
+        try:
+
+            return [image.sum() for frame, image in player.frames()]
+
+        finally:
+
+            player.close()
+
+    def test_plays_past_end_of_video(self):
+
+        for reuse in (False, True):
+
+            sums = self.play(reuse)
+
+            # Frames after the end of the file are black instead of ending playback
+
+            self.assertEqual(len(sums), self.FRAMES + self.EXTRA - 1)
+
+            self.assertTrue(all(sums[:self.FRAMES - 1]))
+
+            self.assertFalse(any(sums[self.FRAMES:]))
+
+if __name__ == "__main__":
+
+    unittest.main()